@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import chess
+import cv2
+import numpy as np
+
+from autotune import default_sets, load_tuned
+from batch_recognize import calibrate_directory, list_images
+from benchmark import slack_ms, tolerance
+from calibration import board_box, rectify
+from detectors import detect_board, engines
+from sequence_labels import labeled_grids
+
+baseline_path = "./accuracy_baseline.json"
+# Row and column order of the confusion matrix, ' ' is an empty square
+symbols = " PNBRQKpnbrqk"
+
+def recognizer_kwargs(image_set, use_tuned=True):
+    '''
+    detect_board keyword arguments for an image set, the autotune.py
+    settings if there are any.
+    '''
+    tuned = load_tuned(image_set) if use_tuned else None
+    if tuned is None:
+        return {}
+    return {"lower": tuned["lower"], "blur": tuned["blur"], "split_rim": tuned["split_rim"], **tuned["hough"]}
+
+def mismatches(truth, chess_grid):
+    '''
+    Squares where the recognized grid differs, as "e4: P -> ' '" strings.
+    '''
+    rows, cols = np.nonzero(truth != chess_grid)
+    return [
+        f"{chess.square_name(chess.square(col, 7 - row))}: {truth[row, col]!r} -> {chess_grid[row, col]!r}"
+        for row, col in zip(rows, cols)
+    ]
+
+def evaluate_set(directory, engine="hough", use_tuned=True, verbose=False):
+    '''
+    Recognizes every labeled image of a set and compares it to the true
+    position. Returns a report dict, or None if the board was not found.
+    '''
+    image_set = os.path.basename(os.path.normpath(directory))
+    calibration = calibrate_directory(list_images(directory))
+    if calibration is None:
+        return None
+    homography, size = calibration
+    kwargs = recognizer_kwargs(image_set, use_tuned)
+    confusion = np.zeros((len(symbols), len(symbols)), dtype=np.int64)
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+    lookup = np.vectorize(index.get)
+    times = []
+    exact = 0
+    for path, truth in labeled_grids(directory):
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Error: {path} could not be loaded", file=sys.stderr)
+            continue
+        start = time.perf_counter()
+        board = rectify(image, homography, size)
+        chess_grid = detect_board(board, board_box(size), engine, **kwargs)
+        times.append((time.perf_counter() - start) * 1000)
+        np.add.at(confusion, (lookup(truth), lookup(chess_grid)), 1)
+        wrong = mismatches(truth, chess_grid)
+        exact += not wrong
+        if verbose and wrong:
+            print(f"  {os.path.basename(path)} ({times[-1]:.2f} ms): {', '.join(wrong)}")
+    if not times:
+        return None
+    p50, p95 = np.percentile(times, (50, 95))
+    return {
+        "frames": len(times),
+        "exact": exact,
+        "accuracy": round(float(np.trace(confusion) / confusion.sum()), 6),
+        "p50": round(p50, 3),
+        "p95": round(p95, 3),
+        "max": round(max(times), 3),
+        "fps": round(1000 / np.mean(times), 1),
+        "confusion": confusion.tolist(),
+    }
+
+def print_confusion(confusion):
+    '''
+    Prints the rows and columns of the confusion matrix that are not all
+    zero. Rows are the true contents, columns what was recognized.
+    '''
+    confusion = np.asarray(confusion)
+    used = np.flatnonzero(confusion.sum(axis=0) + confusion.sum(axis=1))
+    labels = [symbols[i] if symbols[i] != ' ' else '.' for i in used]
+    print("  true \\ seen " + "".join(f"{label:>6}" for label in labels))
+    for i, label in zip(used, labels):
+        print(f"  {label:<12}" + "".join(f"{confusion[i, j]:>6}" for j in used))
+
+def print_report(report):
+    for image_set, result in report.items():
+        print(f"\n{image_set}: {result['exact']}/{result['frames']} positions exact, "
+              f"{result['accuracy']:.2%} of squares, {result['fps']} frames/s")
+        print(f"  latency p50 {result['p50']:.3f} ms, p95 {result['p95']:.3f} ms, max {result['max']:.3f} ms")
+        print_confusion(result["confusion"])
+
+def regressions(report, baseline, tolerance=tolerance, slack_ms=slack_ms):
+    found = []
+    for image_set, result in report.items():
+        if image_set not in baseline:
+            continue
+        if result["accuracy"] < baseline[image_set]["accuracy"]:
+            found.append(f"{image_set}: accuracy {result['accuracy']:.4f} < {baseline[image_set]['accuracy']:.4f}")
+        limit = baseline[image_set]["p95"] * (1 + tolerance) + slack_ms
+        if result["p95"] > limit:
+            found.append(f"{image_set}: p95 {result['p95']:.3f} ms > {limit:.3f} ms")
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare recognized positions with the games encoded in the file names")
+    parser.add_argument("directories", nargs="*", default=default_sets)
+    parser.add_argument("--engine", choices=engines, default="hough")
+    parser.add_argument("--untuned", action="store_true", help="ignore tuned_params.json")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list the wrong squares of every image")
+    parser.add_argument("--baseline", default=baseline_path)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=tolerance)
+    args = parser.parse_args()
+
+    report = {}
+    for directory in args.directories:
+        image_set = os.path.basename(os.path.normpath(directory))
+        if args.verbose:
+            print(image_set)
+        result = evaluate_set(directory, args.engine, not args.untuned, args.verbose)
+        if result is None:
+            print(f"Error: Board not found in {directory}, skipping it", file=sys.stderr)
+            continue
+        report[image_set] = result
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        if found:
+            print("\nRegressions against baseline:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
@@ -0,0 +1,176 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from batch_recognize import calibrate_directory, init_worker, list_images
+from calibration import board_box, rectify
+from detectors import detect_hough, hough_params
+from sequence_labels import labeled_grids
+
+tuned_path = "./tuned_params.json"
+# Image sets the ring classifier can read; one_color and two_colors only
+# mark occupancy with dots
+default_sets = ["./images/chess_game_sequence/eight_colors"]
+
+search_space = {
+    "dp": (1, 1.5, 2),
+    "param1": (10, 20, 30, 50),
+    "param2": (8, 10, 12, 15, 20),
+    "minRadius": (10, 15, 18),
+    "maxRadius": (25, 30, 35),
+    # Gaussian kernel size of the mask blur, 0 for none
+    "blur": (0, 5, 9),
+    # Lower saturation bound of color_threshold_lower
+    "saturation": (10, 50, 100),
+    "split_rim": (False, True),
+}
+blur_sigma = 2
+
+# The hand-picked settings of main.py and chess_seer.py, always evaluated
+reference_configs = [
+    {**hough_params, "blur": 0, "saturation": 10, "split_rim": False},
+    {**hough_params, "blur": 9, "saturation": 100, "split_rim": True},
+]
+
+def recognizer_settings(config):
+    '''
+    Splits a search config into the recognizer's color_threshold_lower,
+    blur, split_rim and HoughCircles parameters.
+    '''
+    hough = {name: config[name] for name in hough_params if name in config}
+    blur = ((config["blur"], config["blur"]), blur_sigma) if config["blur"] else None
+    return {"lower": (0, config["saturation"], 0), "blur": blur,
+            "split_rim": config["split_rim"], "hough": hough}
+
+def sample_configs(trials, seed=0):
+    '''
+    Up to trials distinct configs drawn from search_space, after the
+    reference configs. Invalid radius ranges are skipped.
+    '''
+    names = list(search_space)
+    space = [
+        dict(zip(names, values)) for values in itertools.product(*search_space.values())
+        if values[names.index("minRadius")] < values[names.index("maxRadius")]
+    ]
+    random.Random(seed).shuffle(space)
+    configs = list(reference_configs)
+    for config in space:
+        if len(configs) >= trials + len(reference_configs):
+            break
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+# Rectified boards and their true chess_grids, set once per worker process
+tune_boards = []
+
+def init_tuner(boards):
+    global tune_boards
+    init_worker()
+    tune_boards = boards
+
+def evaluate(config):
+    '''
+    Runs one config over every board. Returns (config, fraction of squares
+    right, median milliseconds per frame).
+    '''
+    settings = recognizer_settings(config)
+    hough = settings.pop("hough")
+    correct = 0
+    times = []
+    for board, truth in tune_boards:
+        start = time.perf_counter()
+        chess_grid = detect_hough(board, board_box(board.shape[0]), **settings, **hough)
+        times.append(time.perf_counter() - start)
+        correct += np.count_nonzero(chess_grid == truth)
+    return config, correct / (64 * len(tune_boards)), float(np.median(times)) * 1000
+
+def pareto_front(results):
+    '''
+    The results no other result beats on both accuracy and time, fastest
+    first.
+    '''
+    front = []
+    for result in sorted(results, key=lambda result: (result[2], -result[1])):
+        if not front or result[1] > front[-1][1]:
+            front.append(result)
+    return front
+
+def pick(front, max_loss=0.0):
+    '''
+    Fastest point of the front within max_loss of the best accuracy.
+    '''
+    best = max(accuracy for _, accuracy, _ in front)
+    return next(result for result in front if result[1] >= best - max_loss)
+
+def load_boards(directory):
+    paths = list_images(directory)
+    calibration = calibrate_directory(paths)
+    if calibration is None:
+        return None
+    homography, size = calibration
+    return [(rectify(cv2.imread(path), homography, size), truth) for path, truth in labeled_grids(directory)]
+
+def tune(boards, configs, processes=None, chunksize=2):
+    with multiprocessing.Pool(processes, initializer=init_tuner, initargs=(boards,)) as pool:
+        return list(pool.imap_unordered(evaluate, configs, chunksize))
+
+def save_tuned(tuned, path=tuned_path):
+    with open(path, "w") as out:
+        json.dump(tuned, out, indent=4)
+
+def load_tuned(image_set, path=tuned_path):
+    '''
+    Returns the recognizer settings tuned for an image set, as given by
+    recognizer_settings, or None if it has not been tuned.
+    '''
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        config = json.load(file).get(image_set)
+    if config is None:
+        return None
+    return recognizer_settings(config)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the HoughCircles and threshold settings for each image set")
+    parser.add_argument("directories", nargs="*", default=default_sets)
+    parser.add_argument("-n", "--trials", type=int, default=200, help="configs to sample per image set")
+    parser.add_argument("-j", "--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--max-loss", type=float, default=0.0,
+                        help="square accuracy to give up for a faster config")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=tuned_path)
+    args = parser.parse_args()
+
+    tuned = {}
+    if os.path.exists(args.out):
+        with open(args.out) as file:
+            tuned = json.load(file)
+    configs = sample_configs(args.trials, args.seed)
+    for directory in args.directories:
+        image_set = os.path.basename(os.path.normpath(directory))
+        boards = load_boards(directory)
+        if not boards:
+            print(f"Error: Board not found in {directory}, skipping it", file=sys.stderr)
+            continue
+        start = time.perf_counter()
+        results = tune(boards, configs, args.processes)
+        print(f"{image_set}: {len(configs)} configs over {len(boards)} frames in "
+              f"{time.perf_counter() - start:.1f} s")
+        front = pareto_front(results)
+        print(f"{'accuracy':>9} {'ms':>7}  config")
+        for config, accuracy, ms in front:
+            print(f"{accuracy:>9.4f} {ms:>7.2f}  {json.dumps(config)}")
+        config, accuracy, ms = pick(front, args.max_loss)
+        tuned[image_set] = {**config, "accuracy": round(accuracy, 6), "ms": round(ms, 3)}
+    save_tuned(tuned, args.out)
+    print(f"Saved to {args.out}")
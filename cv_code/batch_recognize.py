@@ -0,0 +1,105 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import cv2
+
+from board_io import generate_fen
+from calibration import board_box, board_homography, board_size, load_calibration, rectify
+from detectors import detect_board, engines
+
+image_patterns = ("*.png", "*.jpg", "*.JPG")
+
+def list_images(directory):
+    paths = []
+    for pattern in image_patterns:
+        paths.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(set(paths))
+
+def calibrate_directory(paths):
+    '''
+    Finds the board homography for a directory of captures from the same
+    camera position, trying the start position first.
+    '''
+    paths = sorted(paths, key=lambda path: os.path.basename(path) != "start_position.png")
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        homography = board_homography(image)
+        if homography is not None:
+            return homography, board_size
+    return None
+
+def init_worker():
+    # One OpenCV thread per process, the pool already uses every core
+    cv2.setNumThreads(1)
+
+def recognize_file(task):
+    path, calibration, engine = task
+    start = time.perf_counter()
+    image = cv2.imread(path)
+    if image is None:
+        return {"path": path, "error": "Image not found or could not be loaded"}
+    homography, size = calibration
+    board = rectify(image, homography, size)
+    chess_grid = detect_board(board, board_box(size), engine)
+    return {
+        "path": path,
+        "fen": generate_fen(chess_grid),
+        "seconds": round(time.perf_counter() - start, 6),
+    }
+
+def build_tasks(directories, engine, calibration=None):
+    tasks = []
+    for directory in directories:
+        paths = list_images(directory)
+        directory_calibration = calibration or calibrate_directory(paths)
+        if directory_calibration is None:
+            print(f"Error: Board not found in {directory}, skipping it", file=sys.stderr)
+            continue
+        tasks.extend((path, directory_calibration, engine) for path in paths)
+    return tasks
+
+def run(tasks, out, processes=None, chunksize=4):
+    '''
+    Recognizes every task across a process pool and writes one JSON line per
+    image to out, in input order. Returns (images, errors, wall seconds).
+    '''
+    errors = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes, initializer=init_worker) as pool:
+        for result in pool.imap(recognize_file, tasks, chunksize):
+            errors += "error" in result
+            out.write(json.dumps(result) + "\n")
+    return len(tasks), errors, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recognize every image in one or more directories and write FENs as JSON Lines")
+    parser.add_argument("directories", nargs="+")
+    parser.add_argument("-o", "--output", help="JSON Lines file, stdout if omitted")
+    parser.add_argument("-j", "--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--engine", choices=engines, default="hough")
+    parser.add_argument("--calibration", help="stored homography to use for every directory")
+    args = parser.parse_args()
+
+    calibration = None
+    if args.calibration:
+        calibration = load_calibration(args.calibration)
+        if calibration is None:
+            print(f"Error: No calibration at {args.calibration}", file=sys.stderr)
+            raise SystemExit(1)
+
+    tasks = build_tasks(args.directories, args.engine, calibration)
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        count, errors, seconds = run(tasks, out, args.processes)
+    finally:
+        if args.output:
+            out.close()
+    print(f"{count} images ({errors} errors) in {seconds:.2f} s with {args.processes} processes, "
+          f"{count / seconds if seconds else 0:.1f} images/s", file=sys.stderr)
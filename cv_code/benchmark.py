@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from batch_recognize import list_images
+from board_io import generate_fen
+from detectors import color_threshold_lower, color_threshold_upper, find_circles, grid_from_circles
+
+image_sets = [
+    "./images/chess_game_sequence/one_color",
+    "./images/chess_game_sequence/two_colors",
+    "./images/starter_grid",
+]
+# Frame widths to replay every image at
+widths = (640, 1280, 1640)
+baseline_path = "./benchmark_baseline.json"
+# A stage regresses when its p95 grows past baseline * (1 + tolerance) + slack
+tolerance = 0.25
+slack_ms = 0.5
+
+blur = ((9,9), 2)
+
+stages = ("cvtColor", "inRange", "mask", "GaussianBlur", "HoughCircles", "classify", "generate_fen")
+
+def load_frames(directories, width):
+    frames = []
+    for directory in directories:
+        for path in list_images(directory):
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            height = round(image.shape[0] * width / image.shape[1])
+            frames.append(cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA))
+    return frames
+
+def time_frame(image, times):
+    '''
+    Runs the recognition pipeline on one frame, appending the milliseconds
+    spent in each stage to times.
+    '''
+    clock = time.perf_counter
+
+    start = clock()
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    t1 = clock()
+    in_range = cv2.inRange(hsv, color_threshold_lower, color_threshold_upper)
+    t2 = clock()
+    colors = cv2.bitwise_not(in_range)
+    t3 = clock()
+    blurred = cv2.GaussianBlur(colors, *blur)
+    t4 = clock()
+    circles = find_circles(blurred)
+    t5 = clock()
+    chess_grid = grid_from_circles(hsv, circles, (0, 0, image.shape[1], image.shape[0]))
+    t6 = clock()
+    generate_fen(chess_grid)
+    t7 = clock()
+
+    for stage, begin, end in zip(stages, (start, t1, t2, t3, t4, t5, t6), (t1, t2, t3, t4, t5, t6, t7)):
+        times[stage].append((end - begin) * 1000)
+
+def run(directories=image_sets, widths=widths, repeat=5):
+    '''
+    Replays every image set at every width and returns
+    {width: {stage: {p50, p95, p99}, "total": {...}, "fps": ...}}.
+    '''
+    report = {}
+    for width in widths:
+        frames = load_frames(directories, width)
+        times = {stage: [] for stage in stages}
+        for _ in range(repeat):
+            for frame in frames:
+                time_frame(frame, times)
+        totals = np.sum([times[stage] for stage in stages], axis=0)
+        result = {}
+        for stage, values in list(times.items()) + [("total", totals)]:
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            result[stage] = {"p50": round(p50, 3), "p95": round(p95, 3), "p99": round(p99, 3)}
+        result["fps"] = round(1000 / np.mean(totals), 1)
+        report[str(width)] = result
+    return report
+
+def print_report(report):
+    for width, result in report.items():
+        print(f"\n{width} px wide, {result['fps']} frames/s")
+        print(f"  {'stage':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for stage in stages + ("total",):
+            row = result[stage]
+            print(f"  {stage:<14}{row['p50']:>10.3f}{row['p95']:>10.3f}{row['p99']:>10.3f}")
+
+def regressions(report, baseline, tolerance=tolerance, slack_ms=slack_ms):
+    found = []
+    for width, result in report.items():
+        if width not in baseline:
+            continue
+        for stage in stages + ("total",):
+            limit = baseline[width][stage]["p95"] * (1 + tolerance) + slack_ms
+            if result[stage]["p95"] > limit:
+                found.append(f"{width} px {stage}: p95 {result[stage]['p95']:.3f} ms > {limit:.3f} ms")
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage latency of the vision pipeline on the bundled image sets")
+    parser.add_argument("directories", nargs="*", default=image_sets)
+    parser.add_argument("--widths", type=int, nargs="+", default=widths)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=baseline_path)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=tolerance)
+    args = parser.parse_args()
+
+    report = run(args.directories, args.widths, args.repeat)
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        if found:
+            print("\nRegressions against baseline:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline")
@@ -0,0 +1,57 @@
+piece_icon = {
+    "K":u"♔",
+    "Q":u"♕",
+    "R":u"♖",
+    "B":u"♗",
+    "N":u"♘",
+    "P":u"♙",
+    "k":u"♚",
+    "q":u"♛",
+    "r":u"♜",
+    "b":u"♝",
+    "n":u"♞",
+    "p":u"♟"
+}
+
+def generate_fen(chess_grid):
+    res = []
+    seperator = ''
+    for row in chess_grid:
+        res.append(seperator)
+        emptyCount = 0
+        for square in row:
+            if square == ' ':
+                emptyCount += 1
+            else:
+                if emptyCount:
+                    res.append(str(emptyCount))
+                    emptyCount = 0
+                res.append(square)
+        if emptyCount:
+            res.append(str(emptyCount))
+        seperator = "/"
+    res.append(" b KQkq - 0 1")
+    return ''.join(res)
+
+def print_board(board):
+    if hasattr(board, "to_grid"):
+        board = board.to_grid()
+    print()
+    print()
+    for i, row in enumerate(board):
+        print(8 - i, end=" ")
+        for j, square in enumerate(row):
+            if i % 2 == j % 2:
+                print('\033[30;47m ', end='')
+            else:
+                print('\033[30;100m ', end='')
+            if square in piece_icon:
+                print(piece_icon[square], end=' ')
+            else:
+                #print(u'■' if i % 2 == j % 2 else u'□', end=' ')
+                print('  ', end='')
+            print('\033[0m', end='')
+        print()
+    print('  a b c d e f g h')
+    print()
+    print()
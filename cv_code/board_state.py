@@ -0,0 +1,101 @@
+import chess
+import numpy as np
+
+from detectors import empty_grid
+
+# Bitboard order inside a BoardState
+piece_symbols = "PNBRQKpnbrqk"
+
+def grid_mask(mask):
+    '''
+    Packs an 8x8 boolean array laid out like chess_grid (row 0 is rank 8)
+    into a 64-bit int with bit 0 on a1, as python-chess numbers squares.
+    '''
+    return int.from_bytes(np.packbits(mask[::-1].ravel(), bitorder="little").tobytes(), "little")
+
+def mask_grid(bitboard):
+    bits = np.unpackbits(np.frombuffer(bitboard.to_bytes(8, "little"), dtype=np.uint8), bitorder="little")
+    return bits.reshape(8, 8)[::-1].astype(bool)
+
+class BoardState:
+    '''
+    Compact recognition result: one 64-bit bitboard per piece letter plus
+    their union. Equal positions compare and hash as a handful of ints, and
+    the squares that differ between two states come from XORs.
+
+    Attributes:
+        pieces;     tuple;  bitboards in piece_symbols order
+        occupied;   int;    union of all piece bitboards
+    '''
+
+    __slots__ = ("pieces", "occupied")
+
+    def __init__(self, pieces):
+        self.pieces = tuple(pieces)
+        occupied = 0
+        for bitboard in self.pieces:
+            occupied |= bitboard
+        self.occupied = occupied
+
+    @classmethod
+    def from_grid(cls, chess_grid):
+        chess_grid = np.asarray(chess_grid)
+        return cls(grid_mask(chess_grid == symbol) for symbol in piece_symbols)
+
+    @classmethod
+    def from_board(cls, board):
+        return cls(
+            board.pieces_mask(chess.Piece.from_symbol(symbol).piece_type, symbol.isupper())
+            for symbol in piece_symbols
+        )
+
+    @classmethod
+    def from_fen(cls, fen):
+        return cls.from_board(chess.BaseBoard(fen.split()[0]))
+
+    def to_grid(self):
+        chess_grid = empty_grid()
+        for symbol, bitboard in zip(piece_symbols, self.pieces):
+            if bitboard:
+                chess_grid[mask_grid(bitboard)] = symbol
+        return chess_grid
+
+    def to_board(self):
+        board = chess.BaseBoard.empty()
+        for symbol, bitboard in zip(piece_symbols, self.pieces):
+            piece = chess.Piece.from_symbol(symbol)
+            for square in chess.scan_forward(bitboard):
+                board.set_piece_at(square, piece)
+        return board
+
+    def board_fen(self):
+        return self.to_board().board_fen()
+
+    def squares(self, symbol=None):
+        '''
+        SquareSet of the occupied squares, or of one piece letter.
+        '''
+        if symbol is None:
+            return chess.SquareSet(self.occupied)
+        return chess.SquareSet(self.pieces[piece_symbols.index(symbol)])
+
+    def diff(self, other):
+        '''
+        Bitboard of the squares whose contents differ between two states.
+        '''
+        changed = 0
+        for mine, theirs in zip(self.pieces, other.pieces):
+            changed |= mine ^ theirs
+        return changed
+
+    def changed_squares(self, other):
+        return chess.SquareSet(self.diff(other))
+
+    def __eq__(self, other):
+        return isinstance(other, BoardState) and self.pieces == other.pieces
+
+    def __hash__(self):
+        return hash(self.pieces)
+
+    def __repr__(self):
+        return f"BoardState('{self.board_fen()}')"
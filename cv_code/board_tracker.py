@@ -0,0 +1,154 @@
+import cv2
+import numpy as np
+
+from calibration import board_size, methods, to_gray
+
+# Scale of the luma image the grid points are followed on
+track_scale = 0.5
+# Mean distance in board pixels between the tracked points and where the
+# fitted homography puts them, above which the grid is detected again
+max_track_error = 1.0
+lk_params = {
+    "winSize": (15, 15),
+    "maxLevel": 2,
+    "criteria": (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+}
+# Frames skipped at most between full grid detections while the board is
+# lost, doubling from one after each failed detection
+max_detect_backoff = 32
+# Where each finder's grid points lie on the board, in units of squares
+grid_targets = {
+    "corners": np.mgrid[1:8, 1:8][::-1].transpose(1, 2, 0).reshape(-1, 2).astype(np.float32),
+    "markers": np.mgrid[0:8, 0:8][::-1].transpose(1, 2, 0).reshape(-1, 2).astype(np.float32) + 0.5,
+}
+
+class BoardTracker:
+    '''
+    Keeps the board homography current from frame to frame. The grid is
+    found once with the calibration finders, then its points are followed
+    with pyramidal Lucas-Kanade optical flow on a downscaled luma image.
+    The points lie on the board plane, so a homography fits them exactly
+    while tracking holds; once the fit residual grows, e.g. after the board
+    is bumped, the grid is detected from scratch again.
+
+    Attributes:
+        method;     str;        calibration finder, "corners" or "markers"
+        homography; ndarray;    camera to board homography of the last frame
+        points;     ndarray;    tracked grid points in downscaled pixels, None before detection
+        targets;    ndarray;    where the points belong on the board, in board pixels
+        error;      float;      fit residual of the last frame in board pixels
+        detections; int;        frames that needed a full grid detection
+        tracked;    int;        frames registered by optical flow alone
+        scale;      float;      size of the tracked images relative to the frames the homography is for
+        wait;       int;        frames left before the grid is detected again
+    '''
+
+    def __init__(self, method="corners", size=board_size, scale=track_scale, max_error=max_track_error,
+                 max_backoff=max_detect_backoff):
+        self.method = method
+        self.size = size
+        self.scale = scale
+        self.max_error = max_error
+        self.max_backoff = max_backoff
+        self.backoff = 0
+        self.wait = 0
+        self.homography = None
+        self.points = None
+        self.targets = None
+        self.previous = None
+        self.error = 0.0
+        self.detections = 0
+        self.tracked = 0
+
+    def shrink(self, image):
+        return cv2.resize(to_gray(image), None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def fit(self, points):
+        '''
+        Homography from downscaled points to their targets and its mean
+        residual.
+        '''
+        points = points.reshape(-1, 2) / self.scale
+        homography, _ = cv2.findHomography(points, self.targets)
+        if homography is None:
+            return None, np.inf
+        projected = cv2.perspectiveTransform(points.reshape(-1, 1, 2), homography).reshape(-1, 2)
+        return homography, float(np.linalg.norm(projected - self.targets, axis=1).mean())
+
+    def seed(self, homography):
+        '''
+        Starts from a stored homography instead of detecting the grid: the
+        grid points are projected into the frame and refined on the first
+        update.
+        '''
+        self.targets = grid_targets[self.method] * (self.size / 8)
+        points = cv2.perspectiveTransform(self.targets.reshape(-1, 1, 2), np.linalg.inv(homography))
+        self.points = points.astype(np.float32) * self.scale
+        self.homography = homography
+        self.previous = None
+
+    def detect(self, image, scaled=False):
+        found = methods[self.method](image)
+        if found is None:
+            self.points = None
+            return None
+        points, targets = found
+        self.points = points.reshape(-1, 1, 2).astype(np.float32) * (1 if scaled else self.scale)
+        self.targets = targets.reshape(-1, 2).astype(np.float32) * (self.size / 8)
+        self.homography, self.error = self.fit(self.points)
+        self.detections += 1
+        return self.homography
+
+    def redetect(self, image, scaled=False):
+        '''
+        Detects the grid unless the last failed detections ask to wait.
+        '''
+        if self.wait > 0:
+            self.wait -= 1
+            return None
+        homography = self.detect(image, scaled)
+        if homography is None:
+            self.backoff = min(2 * self.backoff, self.max_backoff) if self.backoff else 1
+            self.wait = self.backoff
+        else:
+            self.backoff = 0
+        return homography
+
+    def refine(self, small):
+        '''
+        Snaps seeded corner points onto the corners of the first image.
+        Returns False if they no longer fit a homography, i.e. the board
+        moved since it was calibrated.
+        '''
+        points = self.points
+        if self.method == "corners":
+            points = cv2.cornerSubPix(small, points.copy(), (5, 5), (-1, -1), lk_params["criteria"])
+        homography, error = self.fit(points)
+        if error > self.max_error:
+            return False
+        self.points, self.homography, self.error = points, homography, error
+        return True
+
+    def update(self, image, scaled=False):
+        '''
+        Registers one frame. Returns the camera to board homography, or None
+        if the grid was lost and could not be found again. With scaled, image
+        is a luma image already at scale, e.g. the lores Y plane; the
+        homography is still for full size frames.
+        '''
+        small = image if scaled else self.shrink(image)
+        previous, self.previous = self.previous, small
+        if self.points is not None:
+            if previous is None:
+                if self.refine(small):
+                    return self.homography
+            else:
+                points, status, _ = cv2.calcOpticalFlowPyrLK(previous, small, self.points, None, **lk_params)
+                if status.all():
+                    homography, error = self.fit(points)
+                    if error <= self.max_error:
+                        self.points, self.homography, self.error = points, homography, error
+                        self.tracked += 1
+                        return homography
+            self.points = None
+        return self.redetect(image, scaled)
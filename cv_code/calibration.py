@@ -0,0 +1,267 @@
+import argparse
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from detectors import saturation_mask
+
+# Side of the rectified top-down board in pixels, 60 px per square
+board_size = 480
+calibration_path = "./board_calibration.npz"
+# Lens intrinsics, estimated once per camera
+intrinsics_path = "./camera_intrinsics.npz"
+# Undistortion and homography merged into one fixed-point remap
+remap_path = "./board_remap.npz"
+# A few views of a flat board cannot pin down tangential or high order
+# radial distortion, and the Pi lenses need neither
+intrinsics_flags = cv2.CALIB_ZERO_TANGENT_DIST | cv2.CALIB_FIX_K3
+
+# Inner corners of the 8x8 board
+corner_pattern = (7, 7)
+# One colored marker in the middle of every square, as in scripts/robot_arm.py
+marker_grid = (8, 8)
+marker_threshold_lower = (0, 100, 0)
+marker_threshold_upper = (255, 255, 255)
+
+def board_box(size=board_size):
+    return (0, 0, size, size)
+
+def to_gray(image):
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+def order_grid(points):
+    '''
+    Reorders a (rows, cols, 2) grid of points so that rows run top to
+    bottom and columns run left to right, whatever corner the detector
+    started from.
+    '''
+    row_step = np.abs(points[0, -1] - points[0, 0])
+    if row_step[1] > row_step[0]:
+        points = points.transpose(1, 0, 2)
+    if points[0, 0, 1] > points[-1, 0, 1]:
+        points = points[::-1]
+    if points[0, 0, 0] > points[0, -1, 0]:
+        points = points[:, ::-1]
+    return np.ascontiguousarray(points)
+
+def find_board_corners(image, pattern=corner_pattern):
+    '''
+    Finds the inner corners of the checkered board. Returns the detected
+    points and where they belong on the canonical board, in units of squares.
+    '''
+    gray = to_gray(image)
+    found, corners = cv2.findChessboardCorners(gray, pattern)
+    if not found:
+        found, corners = cv2.findChessboardCornersSB(gray, pattern)
+    if not found:
+        return None
+    cols, rows = pattern
+    corners = order_grid(corners.reshape(rows, cols, 2))
+    targets = np.mgrid[1:rows + 1, 1:cols + 1][::-1].transpose(1, 2, 0)
+    return corners, targets
+
+def find_board_markers(image, grid=marker_grid, lower=marker_threshold_lower,
+                       upper=marker_threshold_upper):
+    '''
+    Finds a grid of colored markers, one per square, with findCirclesGrid.
+    '''
+    hsv = cv2.cvtColor(image[:, :, :3], cv2.COLOR_BGR2HSV)
+    blurred = cv2.GaussianBlur(saturation_mask(hsv, lower, upper), (9,9), 2)
+    found, centers = cv2.findCirclesGrid(blurred, grid, None, flags=cv2.CALIB_CB_SYMMETRIC_GRID)
+    if not found:
+        return None
+    cols, rows = grid
+    centers = order_grid(centers.reshape(rows, cols, 2))
+    targets = np.mgrid[0:rows, 0:cols][::-1].transpose(1, 2, 0) + 0.5
+    return centers, targets
+
+methods = {
+    "corners": find_board_corners,
+    "markers": find_board_markers,
+}
+
+def undistort_points(points, intrinsics):
+    camera_matrix, distortion = intrinsics
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+    return cv2.undistortPoints(points, camera_matrix, distortion, P=camera_matrix).reshape(-1, 2)
+
+def board_homography(image, method="corners", size=board_size, intrinsics=None):
+    '''
+    Returns the homography from camera pixels to the canonical top-down
+    board of size x size pixels, or None if the board was not found. With
+    intrinsics the homography maps undistorted camera pixels instead.
+    '''
+    found = methods[method](image)
+    if found is None:
+        return None
+    points, targets = found
+    points = points.reshape(-1, 2)
+    if intrinsics is not None:
+        points = undistort_points(points, intrinsics)
+    targets = targets.reshape(-1, 2).astype(np.float32) * (size / 8)
+    homography, _ = cv2.findHomography(points, targets)
+    return homography
+
+def calibrate_camera(images, method="corners", flags=intrinsics_flags):
+    '''
+    Estimates the camera matrix and distortion coefficients from pictures
+    of the board taken at different angles. Returns (camera_matrix,
+    distortion, reprojection error in pixels), or None if the board was
+    not found in any of them.
+    '''
+    object_points = []
+    image_points = []
+    for image in images:
+        found = methods[method](image)
+        if found is None:
+            continue
+        points, targets = found
+        targets = targets.reshape(-1, 2).astype(np.float32)
+        object_points.append(np.hstack([targets, np.zeros((len(targets), 1), dtype=np.float32)]))
+        image_points.append(points.reshape(-1, 1, 2).astype(np.float32))
+    if not object_points:
+        return None
+    height, width = images[0].shape[:2]
+    error, camera_matrix, distortion, _, _ = cv2.calibrateCamera(
+        object_points, image_points, (width, height), None, None, flags=flags)
+    return camera_matrix, distortion, error
+
+def save_intrinsics(camera_matrix, distortion, path=intrinsics_path):
+    np.savez(path, camera_matrix=camera_matrix, distortion=distortion)
+
+def load_intrinsics(path=intrinsics_path):
+    '''
+    Returns the stored (camera_matrix, distortion) pair, or None if the
+    camera has not been calibrated.
+    '''
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return data["camera_matrix"], data["distortion"]
+
+def board_maps(homography, intrinsics, image_size, size=board_size):
+    '''
+    Merges lens undistortion and the board homography into one pair of
+    fixed-point remap maps from distorted camera pixels to the top-down
+    board. homography has to map undistorted pixels.
+    '''
+    camera_matrix, distortion = intrinsics
+    # For every undistorted camera pixel, where it lies in the raw frame
+    undistort_x, undistort_y = cv2.initUndistortRectifyMap(
+        camera_matrix, distortion, None, camera_matrix, image_size, cv2.CV_32FC1)
+    # Pulling those through the homography gives, for every board pixel,
+    # where it lies in the raw frame
+    map_x = cv2.warpPerspective(undistort_x, homography, (size, size), borderValue=-1)
+    map_y = cv2.warpPerspective(undistort_y, homography, (size, size), borderValue=-1)
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+def save_remap(maps, path=remap_path):
+    np.savez(path, map_xy=maps[0], map_fraction=maps[1])
+
+def load_remap(path=remap_path):
+    '''
+    Returns the stored fixed-point (map_xy, map_fraction) pair, or None.
+    '''
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return data["map_xy"], data["map_fraction"]
+
+def save_calibration(homography, size=board_size, path=calibration_path, frame_size=None):
+    np.savez(path, homography=homography, size=size, frame=frame_size if frame_size is not None else ())
+
+def load_calibration(path=calibration_path, frame_size=None):
+    '''
+    Returns the stored (homography, size) pair, or None if the board has
+    not been calibrated yet. Given the (width, height) of the frames it will
+    be used on, a homography found on frames of another size, i.e. another
+    camera or image set, is not returned either.
+    '''
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        stored = tuple(int(side) for side in data["frame"]) if "frame" in data else ()
+        if frame_size is not None and stored != tuple(frame_size):
+            print(f"Warning: {path} was calibrated on {stored or 'unknown'} frames, "
+                  f"not {tuple(frame_size)}, calibrating again", file=sys.stderr)
+            return None
+        return data["homography"], int(data["size"])
+
+def calibrate(image, method="corners", size=board_size, path=calibration_path,
+              intrinsics=None, maps_path=remap_path):
+    '''
+    Finds and stores the board homography. With the camera intrinsics the
+    merged undistortion remap is stored too.
+    '''
+    homography = board_homography(image, method, size, intrinsics)
+    if homography is None:
+        print("Error: Board not found in calibration image")
+        return None
+    save_calibration(homography, size, path, image.shape[1::-1])
+    if intrinsics is not None:
+        save_remap(board_maps(homography, intrinsics, image.shape[1::-1], size), maps_path)
+    return homography, size
+
+def rectify(image, homography, size=board_size, dst=None):
+    '''
+    Warps a camera frame to the canonical board, where square (row, col)
+    covers pixels [row * size // 8, (row + 1) * size // 8).
+    '''
+    return cv2.warpPerspective(image, homography, (size, size), dst=dst)
+
+def rectify_remap(image, maps, dst=None):
+    '''
+    rectify for a distorted frame, through the maps of board_maps.
+    '''
+    return cv2.remap(image, maps[0], maps[1], cv2.INTER_LINEAR, dst=dst)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the board once and store its homography")
+    parser.add_argument("image", nargs="?", help="picture of the board taken from the camera position")
+    parser.add_argument("--method", choices=methods, default="corners")
+    parser.add_argument("--size", type=int, default=board_size)
+    parser.add_argument("--out", default=calibration_path)
+    parser.add_argument("--camera", nargs="+", metavar="VIEW",
+                        help="estimate the lens distortion from views of the board at different angles")
+    parser.add_argument("--intrinsics", default=intrinsics_path)
+    parser.add_argument("--remap", default=remap_path)
+    parser.add_argument("--show", action="store_true", help="display the rectified board")
+    args = parser.parse_args()
+    if args.image is None and args.camera is None:
+        parser.error("give a board picture, --camera views or both")
+
+    if args.camera:
+        views = [cv2.imread(path) for path in args.camera]
+        views = [view for view in views if view is not None]
+        camera = calibrate_camera(views, args.method) if views else None
+        if camera is None:
+            print("Error: Board not found in any camera view")
+            raise SystemExit(1)
+        camera_matrix, distortion, error = camera
+        save_intrinsics(camera_matrix, distortion, args.intrinsics)
+        print(f"Reprojection error {error:.3f} px, distortion {distortion.ravel()}")
+    if args.image is None:
+        raise SystemExit(0)
+
+    image = cv2.imread(args.image)
+    if image is None:
+        print("Error: Image not found or could not be loaded")
+        raise SystemExit(1)
+    intrinsics = load_intrinsics(args.intrinsics)
+    calibration = calibrate(image, args.method, args.size, args.out, intrinsics, args.remap)
+    if calibration is None:
+        raise SystemExit(1)
+    print(calibration[0])
+    if args.show:
+        if intrinsics is not None:
+            cv2.imshow('Rectified Board', rectify_remap(image, load_remap(args.remap)))
+        else:
+            cv2.imshow('Rectified Board', rectify(image, *calibration))
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
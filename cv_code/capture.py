@@ -0,0 +1,278 @@
+import glob
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# Time for the sensor's auto exposure to settle after the camera starts
+warmup_time = 2
+
+def encode_frame(image, format):
+    '''
+    Lays out a BGR image the way Picamera2 returns the given format.
+    '''
+    if format == "XBGR8888":
+        # BGR plus a padding byte
+        return cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    if format == "YUV420":
+        # Y plane followed by quarter size U and V planes, even sizes only
+        height, width = image.shape[:2]
+        return cv2.cvtColor(image[:height // 2 * 2, :width // 2 * 2], cv2.COLOR_BGR2YUV_I420)
+    return image
+
+class FileCamera:
+    '''
+    Stand-in for Picamera2 that plays back image files, for running the
+    capture loop offline. When a lores stream is configured, capturing it
+    advances playback and the main stream returns the same frame at full
+    size, like two streams of one sensor. Each image is shown for hold
+    frames, long enough for the stability gate to settle on it; with step
+    it is shown until the main stream has captured it, so every image is
+    taken exactly once whenever the captures happen. cover dark frames
+    between images stand in for the hand that moved the piece.
+
+    Attributes:
+        frames;     list;   decoded BGR frames, in playback order
+        encoded;    list;   main stream frames in format, filled on first capture
+        interval;   float;  seconds between frames, 0 to play as fast as possible
+        loop;       bool;   start over after the last frame instead of returning None
+        hold;       int;    frames each image is shown for
+        step;       bool;   show each image until main captures it instead
+        cover;      int;    dark frames shown between images
+        format;     str;    Picamera2 pixel format of main, XBGR8888, BGR888 or YUV420
+        main_size;  tuple;  (width, height) frames are scaled to, None to keep the files' size
+        lores_size; tuple;  (width, height) of the YUV420 lores stream, None if off
+    '''
+
+    def __init__(self, source, fps=10, loop=False, format="XBGR8888", hold=1, step=False, cover=0):
+        if os.path.isdir(source):
+            paths = sorted(glob.glob(os.path.join(source, "*.png")) + glob.glob(os.path.join(source, "*.jpg")))
+        else:
+            paths = [source]
+        self.frames = [image for image in map(cv2.imread, paths) if image is not None]
+        if not self.frames:
+            raise FileNotFoundError(f"No images found at {source}")
+        self.interval = 1 / fps if fps else 0
+        self.loop = loop
+        self.hold = hold
+        self.step = step
+        self.cover = cover
+        self.format = format
+        self.main_size = None
+        self.lores_size = None
+        self.encoded = [None] * len(self.frames)
+        self.index = 0
+        self.current = None
+        self.shown = 0
+        self.taken = False
+        self.covered = 0
+        self.last_capture = 0
+
+    def create_preview_configuration(self, main=None, lores=None, **kwargs):
+        return {"main": main or {}, "lores": lores, **kwargs}
+
+    def configure(self, config):
+        self.config = config
+        self.format = config["main"].get("format", self.format)
+        # Scaled once here, like the sensor mode the ISP scales main to
+        self.main_size = config["main"].get("size")
+        if self.main_size is not None:
+            self.frames = [cv2.resize(frame, self.main_size, interpolation=cv2.INTER_AREA) for frame in self.frames]
+        self.encoded = [None] * len(self.frames)
+        if config.get("lores"):
+            self.lores_size = config["lores"]["size"]
+
+    def start(self):
+        self.last_capture = time.monotonic()
+
+    def advance(self):
+        wait = self.last_capture + self.interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self.last_capture = time.monotonic()
+        if self.current is not None:
+            if not self.taken if self.step else self.shown < self.hold:
+                self.shown += 1
+                return True
+            if self.covered < self.cover and self.index < len(self.frames):
+                self.covered += 1
+                return True
+        if self.index >= len(self.frames):
+            if not self.loop:
+                return False
+            self.index = 0
+        self.current = self.index
+        self.index += 1
+        self.shown = 1
+        self.taken = False
+        self.covered = 0
+        return True
+
+    def capture_array(self, name="main"):
+        # The lowest resolution stream paces playback, the other one gives
+        # the same frame, also once playback has run out
+        if name == ("lores" if self.lores_size else "main"):
+            if not self.advance():
+                return None
+        elif self.current is None and not self.advance():
+            return None
+        elif self.step and self.taken:
+            # Lores moves on after each capture, so this image was used up
+            # by the last one and playback has ended
+            return None
+        frame = self.frames[self.current]
+        if self.covered:
+            frame = np.zeros_like(frame)
+            if name == "lores":
+                return encode_frame(cv2.resize(frame, self.lores_size), "YUV420")
+            return encode_frame(frame, self.format)
+        if name == "main":
+            self.taken = True
+        if name == "lores":
+            return encode_frame(cv2.resize(frame, self.lores_size, interpolation=cv2.INTER_AREA), "YUV420")
+        # Encode each frame once, the main stream is the expensive one
+        if self.encoded[self.current] is None:
+            self.encoded[self.current] = encode_frame(frame, self.format)
+        return self.encoded[self.current].copy()
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+def open_camera(source=None, preview=False, warmup=warmup_time, format="XBGR8888", lores=None,
+                hold=1, step=False, cover=0, main_size=None):
+    '''
+    Opens and starts the camera once. source is an image file or directory
+    to play back instead of the Pi camera. format is the Picamera2 pixel
+    format of the main stream, YUV420 to skip color conversion entirely.
+    main_size is the (width, height) of the main stream, the Picamera2
+    default if None; played back images are scaled to it as well.
+    lores is the (width, height) of an extra low resolution YUV420 stream
+    for monitoring and preview; main frames are then captured on demand.
+    hold, step and cover set how played back images are shown, see FileCamera.
+    '''
+    if source is not None:
+        camera = FileCamera(source, format=format, hold=hold, step=step, cover=cover)
+        warmup = 0
+    else:
+        from picamera2 import Picamera2, Preview
+        camera = Picamera2()
+        if preview:
+            camera.start_preview(Preview.DRM)
+    config = {"main": {"format": format}}
+    if main_size is not None:
+        config["main"]["size"] = main_size
+    if lores is not None:
+        # The Pi ISP only produces YUV420 on the lores stream
+        config["lores"] = {"size": lores, "format": "YUV420"}
+        config["display"] = "lores"
+    camera.configure(camera.create_preview_configuration(**config))
+    camera.start()
+    time.sleep(warmup)
+    return camera
+
+class FrameGrabber:
+    '''
+    Producer thread that keeps capturing from an open camera into a bounded
+    queue. When the consumer falls behind the oldest frame is dropped, so
+    whatever is taken from the queue is at most maxsize frames old. A None
+    in the queue means the camera ran out of frames. stream is the camera
+    stream to poll, "lores" to monitor cheaply and capture "main" on demand.
+    '''
+
+    def __init__(self, camera, maxsize=2, stream="main"):
+        self.camera = camera
+        self.stream = stream
+        self.requests = queue.Queue()
+        self.frames = queue.Queue(maxsize)
+        self.captured = 0
+        self.dropped = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.is_set():
+            frame = self.camera.capture_array(self.stream)
+            self.serve_requests()
+            if frame is None:
+                break
+            self.captured += 1
+            self.put(frame)
+        self.put(None)
+
+    def serve_requests(self):
+        # Captures of other streams asked for by the consumer are taken
+        # here, right after a frame, so the camera is only used by one thread
+        while True:
+            try:
+                name, reply = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            reply.put(self.camera.capture_array(name))
+
+    def put(self, frame):
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        return self.frames.get(timeout=timeout)
+
+    def latest(self, timeout=None):
+        '''
+        Returns the newest frame, discarding anything older that is queued.
+        '''
+        frame = self.frames.get(timeout=timeout)
+        while frame is not None:
+            try:
+                newer = self.frames.get_nowait()
+            except queue.Empty:
+                break
+            if newer is None:
+                self.put(None)
+                break
+            frame = newer
+        return frame
+
+    def capture(self, name="main"):
+        '''
+        Captures one frame of another stream. The producer thread takes it
+        after its current frame, so this waits at most one frame interval.
+        '''
+        if not self.thread.is_alive():
+            return self.camera.capture_array(name)
+        reply = queue.Queue(1)
+        self.requests.put((name, reply))
+        while True:
+            try:
+                return reply.get(timeout=0.1)
+            except queue.Empty:
+                if not self.thread.is_alive():
+                    # The producer ended before it saw the request
+                    return self.camera.capture_array(name)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -2,22 +2,47 @@ import csv
 import math
 import numpy as np
 import time
-from bisect import bisect
 import os
-
-from picamera2 import Picamera2, Preview
+import sys
 
 #os.environ["QT_DEBUG_PLUGINS"] = "1"
 os.environ["QT_QPA_PLATFORM_PLUGIN_PATH"] = "/home/raspberrypi/Documents/robot_arm/venv/lib/python3.11/site-packages/cv2/qt/plugins/platforms"
 
 import cv2  # Only after setting the environment variable
 
-picam2 = Picamera2()
-
-#picam2.preview_size = (3280, 2464)
+from detectors import detect_board
+from calibration import board_box, calibrate, load_calibration, load_intrinsics, load_remap
+from frame_pipeline import FramePipeline, YuvPipeline
+from color_lut import load_lut
+from capture import open_camera, FrameGrabber
+from board_io import generate_fen, print_board
+from stability import StabilityGate, stable_frames
+from recognition_cache import RecognitionCache
+from autotune import load_tuned
+from board_tracker import BoardTracker, track_scale
 
-camera_config = picam2.create_preview_configuration()#main={"size": (1640, 1232)})
-picam2.configure(camera_config)
+# Image file or directory to play back instead of the camera, e.g.
+# python chess_seer.py images/chess_game_sequence/eight_colors
+source = sys.argv[1] if len(sys.argv) > 1 else None
+# What triggers a recognition: "stable" once the board has stopped moving,
+# "enter" the Enter key, "stream" every frame as it arrives
+trigger = "stable"
+# Frames each played back image is shown for: the stability gate needs
+# stable_frames after the change, plus slack for the on-demand full size
+# capture and a dropped frame. With "enter" each image waits for its capture.
+playback_hold = stable_frames + 3
+# Dark frames between played back images, the motion of the hand that
+# moved the piece, which re-arms the stability gate
+playback_cover = 1
+# Camera pixel format, "YUV420" reads the mask and piece colors straight
+# from the chroma planes without converting the frame to HSV
+capture_format = "XBGR8888"
+# Size of the full resolution main stream recognitions run on, the whole
+# sensor binned 2x2 on the Pi camera v2. None keeps the 640x480 default.
+main_size = (1640, 1232)
+# Size of the YUV420 lores stream watched for motion, full resolution frames
+# are then only captured when a recognition is triggered. None polls main.
+lores_size = (320, 240)
 
 # Setting chessboard grid dimension
 grid_dimension = (8,2)
@@ -27,155 +52,130 @@ grid_dimension = (8,2)
 color_threshold_lower = (0, 100, 0)
 color_threshold_upper= (255, 255, 255)
 
-black = (0, 0, 0)
-white = (255, 255, 255)
-blue = (82, 113, 255)
-green = (0, 191, 99)
-red = (255, 49, 49)
-pink = (255, 102, 196)
-orange = (255, 145, 77)
-yellow = (255, 222, 89)
-
-rows = [1232 // 8 * i for i in range(8)]
-cols = [1640 // 8 * i for i in range(8)]
-
-def get_hue(rgb_color):
-    rgb_array = np.uint8([[list(rgb_color)]])
-    hsv_array = cv2.cvtColor(rgb_array, cv2.COLOR_RGB2HSV)
-    hsv_color = tuple(hsv_array[0][0])
-    return hsv_color[0]
-
-hues = (
-    (get_hue(blue), 'p'),
-    (get_hue(green), 'b'),
-    (get_hue(red), 'k'),
-    (get_hue(pink), 'n'),
-    (get_hue(orange), 'q'),
-    (get_hue(yellow), 'r')
-)
-
-piece_icon = {
-    "K":u"♔",
-    "Q":u"♕",
-    "R":u"♖",
-    "B":u"♗",
-    "N":u"♘",
-    "P":u"♙",
-    "k":u"♚",
-    "q":u"♛",
-    "r":u"♜",
-    "b":u"♝",
-    "n":u"♞",
-    "p":u"♟"
-}
-
-def get_piece(image, circle):
-    x, y, r = (int(a) for a in circle)
-    if y < image.shape[0] // 2:
-        piece_type_color = image[y+r-2][x]
-    else:
-        piece_type_color = image[y-r+2][x]
-    #print(y+r-3, x)
-    #print(piece_type_color)
-    piece_type_hue = piece_type_color[0]
-    closest_type = 'p'
-    closest_dist = float('inf')
-    for hue, piece_type in hues:
-        dist = piece_type_hue - hue
-        if dist < closest_dist:
-            closest_dist = dist
-            closest_type = piece_type
-    piece_center_color = image[y][x]
-    piece_center_val = piece_center_color[2]
-    if piece_center_val > 128:
-        closest_type = closest_type.upper()
-    return closest_type
-
-def piece_coordinate(circle):
-    x, y, r = (int(a) for a in circle)
-    return (min(7, bisect(rows, y)), min(7, bisect(cols, x)))
-
-def generate_fen(chess_grid):
-    res = []
-    seperator = ''
-    for row in chess_grid:
-        res.append(seperator)
-        emptyCount = 0
-        for square in row:
-            if square == ' ':
-                emptyCount += 1
-            else:
-                if emptyCount:
-                    res.append(str(emptyCount))
-                    emptyCount = 0
-                res.append(square)
-        if emptyCount:
-            res.append(str(emptyCount))
-        seperator = "/"
-    res.append(" b KQkq - 0 1")
-    return ''.join(res)
-
-def print_board(board):
-    print()
-    print()
-    for i, row in enumerate(board):
-        print(8 - i, end=" ")
-        for j, square in enumerate(row):
-            if i % 2 == j % 2:
-                print('\033[30;47m ', end='')
-            else:
-                print('\033[30;100m ', end='')
-            if square in piece_icon:
-                print(piece_icon[square], end=' ')
-            else:
-                #print(u'■' if i % 2 == j % 2 else u'□', end=' ')
-                print('  ', end='')
-            print('\033[0m', end='')
-        print()
-    print('  a b c d e f g h')
-    print()
-    print()
+# Homography to the top-down board, loaded or found on the first capture so
+# it can be checked against the frame size
+calibration = None
+frame_size = None
+# Lens distortion from calibration.py --camera. With it every frame is
+# undistorted and rectified by a single remap.
+intrinsics = load_intrinsics()
+board_maps = load_remap() if intrinsics is not None else None
+# Follow the board grid with optical flow so a bumped board is registered
+# again without recalibrating. The undistortion remap assumes a fixed board,
+# so tracking is off while it is in use. The grid is followed on every
+# monitoring frame, starting from the stored calibration.
+track_board = True
+tracker = None
+
+# Detection engine, "hough", "pyramid", "components" or "tiles"
+detector_engine = "hough"
+blur = ((9,9), 2)
+split_rim = True
+hough_settings = {}
+
+# Settings found by autotune.py replace the hand-picked ones. Played back
+# images are looked up by their directory name, the live camera as "camera".
+tuned = load_tuned(os.path.basename(os.path.normpath(source)) if source else "camera")
+if tuned is not None:
+    color_threshold_lower = tuned["lower"]
+    blur = tuned["blur"]
+    split_rim = tuned["split_rim"]
+    hough_settings = tuned["hough"]
+# Color lookup table built by color_lut.py, memory mapped once at startup
+color_lut = load_lut()
+# Horizontal bands of the board processed on separate cores, 1 for none
+processing_bands = min(os.cpu_count() or 1, 4)
+# Buffers for the rectify/HSV/mask/blur stages, sized on the first frame
+pipeline = None
+# Results of recently seen boards, reused while the board is not touched
+cache = RecognitionCache()
 
 # TODO: Create the color ranges for each chess piece
 
 
-while True:
-    picam2.start_preview(Preview.DRM)
-    picam2.start()
-    time.sleep(2)
-    user_input = input("Press Enter to take source picture (\'q\' to quit): ")
-    if user_input == 'q':
-        picam2.close()
-        break
-    image = picam2.capture_array()#[:, :, :3]
-    cv2.imshow('Original Image', image)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
-    picam2.close()
-    print(image)
-    # break the loop if no image is taken
-    if image is None:
-        print("Error: Image not found or could not be loaded")
-        break
-
-    # convert the image to HSV
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    # isolate the pixels based on the lower and upper bounds
-    mask_sat = cv2.inRange(hsv, color_threshold_lower, color_threshold_upper)
-    # Colored pixels = True, Gray pixels = False
-    imask_sat = mask_sat > 0
-    # Create new image setting everything that is not green white
-    colors = np.full(image.shape[:2], 255, dtype=np.uint8)
-    # Setting every color to black
-    colors[imask_sat] = 0
-
-    # blur the images, used for live image capture
-    blurred = cv2.GaussianBlur(colors, (9,9), 2)
+def calibrate_board(image):
+    '''
+    Loads or finds the board homography on a full resolution frame. Returns
+    False if the board could not be calibrated.
+    '''
+    global calibration, board_maps, frame_size
+    # The Y plane of a YUV420 capture is already a grayscale image
+    frame = image[:image.shape[0] * 2 // 3] if capture_format == "YUV420" else image[:, :, :3]
+    frame_size = frame.shape[1::-1]
+    calibration = load_calibration(frame_size=frame_size)
+    if calibration is None:
+        calibration = calibrate(frame, intrinsics=intrinsics)
+        if calibration is None:
+            return False
+        board_maps = load_remap() if intrinsics is not None else None
+    return True
+
+def track(image):
+    '''
+    Follows the board grid on one monitoring frame, so the homography is
+    current whenever a recognition is triggered. Lores frames are tracked
+    on their Y plane as they are. Starts once the first recognition has
+    calibrated the board.
+    '''
+    global tracker
+    if not track_board or board_maps is not None or calibration is None:
+        return
+    homography, board_size = calibration
+    if tracker is None:
+        scale = track_scale if lores_size is None else lores_size[0] / frame_size[0]
+        tracker = BoardTracker(size=board_size, scale=scale)
+        tracker.seed(homography)
+    if lores_size is not None:
+        tracker.update(image[:image.shape[0] * 2 // 3], scaled=True)
+    else:
+        tracker.update(image[:image.shape[0] * 2 // 3] if capture_format == "YUV420" else image)
+
+def recognize(image):
+    '''
+    Runs the HSV, mask, detection and classification stages on one frame.
+    Returns the chess grid and the annotated board, or None if the board
+    could not be calibrated. A board that looks like one recognized recently
+    gets the cached chess grid and the plain rectified board.
+    '''
+    global pipeline
+    yuv = capture_format == "YUV420"
+    if calibration is None and not calibrate_board(image):
+        return None
+    homography, board_size = calibration
+    # Keep the stored homography while the grid cannot be found
+    if tracker is not None and tracker.homography is not None:
+        homography = tracker.homography
+    if pipeline is None:
+        if yuv:
+            pipeline = YuvPipeline(board_size, blur=blur, maps=board_maps)
+        else:
+            pipeline = FramePipeline(board_size, color_threshold_lower, color_threshold_upper,
+                                     blur, channels=image.shape[2], lut=color_lut,
+                                     bands=processing_bands, maps=board_maps)
+
+    # warp to the top-down board and skip the rest if it was seen before
+    board = pipeline.rectify(image, homography)
+    fingerprint = cache.fingerprint(board)
+    chess_grid = cache.get(fingerprint)
+    if chess_grid is not None:
+        return chess_grid, board
+
+    if yuv:
+        pipeline.process()
+        chess_grid, circles = pipeline.recognize(split_rim, **hough_settings)
+        cache.put(fingerprint, chess_grid)
+        display = cv2.cvtColor(pipeline.mask, cv2.COLOR_GRAY2BGR)
+        for i in circles:
+            cv2.circle(display, (int(i[0]), int(i[1])), int(i[2]), (0, 255, 255), 2)
+        return chess_grid, display
+
+    # convert the board to HSV and mask the colored pixels black, all in
+    # place in the pipeline's buffers
+    board, hsv, colors = pipeline.process()
     
     # display images
     # cv2.imshow('image.jpg', image)
-    # cv2.imshow('green.jpg', green)
-    # cv2.imshow('blurred.jpg', blurred)
+    # cv2.imshow('colors.jpg', colors)
 
     '''
     # detect grid pattern
@@ -188,24 +188,83 @@ while True:
     print(ret, corners)
     '''
     
-    circles = cv2.HoughCircles(blurred, cv2.HOUGH_GRADIENT, 1, 20, param1=20, param2=10, minRadius=20, maxRadius=30)
+    if detector_engine == "hough":
+        # on the mask blurred by the pipeline, band by band when it has bands
+        chess_grid, circles = pipeline.recognize(split_rim, **hough_settings)
+    else:
+        circles = []
+        chess_grid = detect_board(board, board_box(board_size), detector_engine, hsv=hsv,
+                                  lower=color_threshold_lower, blur=blur, split_rim=split_rim,
+                                  **hough_settings)
     
     #print(circles)
+    cache.put(fingerprint, chess_grid)
+
+    for i in circles:
+        cv2.circle(hsv, (int(i[0]), int(i[1])), int(i[2]), (0, 255, 255), 2)
+    return chess_grid, hsv
+
+# The camera stays open for the whole session and a background thread keeps
+# the queue filled with fresh frames
+camera = open_camera(source, preview=source is None, format=capture_format, lores=lores_size,
+                     hold=playback_hold, step=trigger == "enter",
+                     cover=playback_cover if trigger == "stable" else 0, main_size=main_size)
+grabber = FrameGrabber(camera, stream="main" if lores_size is None else "lores").start()
+
+if trigger in ("stream", "stable"):
+    gate = StabilityGate(yuv=lores_size is not None or capture_format == "YUV420")
+    last_fen = None
+    while True:
+        image = grabber.get()
+        if image is None:
+            break
+        track(image)
+        # Skip detection while a hand or the arm is over the board
+        if trigger == "stable" and not gate.update(image):
+            continue
+        if lores_size is not None:
+            image = grabber.capture("main")
+            if image is None:
+                break
+        result = recognize(image)
+        if result is None:
+            continue
+        chess_grid, hsv = result
+        fen = generate_fen(chess_grid)
+        if fen != last_fen:
+            print_board(chess_grid)
+            last_fen = fen
+else:
+    while True:
+        user_input = input("Press Enter to take source picture (\'q\' to quit): ")
+        if user_input == 'q':
+            break
+        image = grabber.latest()
+        if image is not None:
+            track(image)
+        if image is not None and lores_size is not None:
+            image = grabber.capture("main")
+        # break the loop if no image is taken
+        if image is None:
+            print("Error: Image not found or could not be loaded")
+            break
+        cv2.imshow('Original Image', image)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
+
+        result = recognize(image)
+        if result is None:
+            continue
+        chess_grid, hsv = result
 
-    chess_grid = np.full((8,8), ' ', dtype=str)
-    
-    if circles is not None:
-        circles = np.uint16(np.around(circles))
-        circles = sorted(circles[0], key=lambda t: (t[0], t[1]))
-        for i in circles:
-            piece = get_piece(hsv, i)
-            chess_grid[piece_coordinate(i)] = piece
-            cv2.circle(hsv, (i[0], i[1]), i[2], (0, 255, 255), 2)
-        
         cv2.imshow('Detected Circles', hsv)
         cv2.waitKey(0)
         cv2.destroyAllWindows()
 
-    print_board(chess_grid)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+        print_board(chess_grid)
+
+grabber.stop()
+camera.close()
+print(f"Recognition cache: {cache.hits} hits, {cache.misses} misses")
+if tracker is not None:
+    print(f"Board tracker: {tracker.tracked} frames tracked, {tracker.detections} grid detections")
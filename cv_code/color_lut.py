@@ -0,0 +1,182 @@
+import argparse
+import os
+
+import chess
+import cv2
+import numpy as np
+
+from calibration import board_homography, rectify, board_size
+from detectors import piece_coordinate, empty_grid
+from game_tracker import board_grid
+from piece_classifier import hue_distance, piece_hues, piece_types, rim_samples
+
+# Bits kept per BGR channel, 5 gives a 32x32x32 table of 32 KB
+lut_bits = 5
+lut_path = "./color_lut.npy"
+# Start positions with ring pieces, the only images whose labels are known
+training_images = ["./images/chess_game_sequence/eight_colors/start_position.png"]
+# Saturation above which a color never seen in training counts as a piece rim
+lut_saturation = 100
+
+# A LUT entry packs the nearest piece type (index into piece_types plus one),
+# whether the color is bright enough for a white piece's center, and
+# whether it is saturated enough to be a rim
+type_mask = 0b111
+light_bit = 0b1000
+colored_bit = 0b10000
+
+def lut_index(pixels, bits=lut_bits):
+    '''
+    (b, g, r) index arrays into a LUT for an array of BGR pixels.
+    '''
+    pixels = np.asarray(pixels)[..., :3] >> (8 - bits)
+    return pixels[..., 0], pixels[..., 1], pixels[..., 2]
+
+def cell_colors(bits=lut_bits):
+    '''
+    BGR color at the middle of every LUT cell, as a (cells, 1, 3) image.
+    '''
+    shift = 8 - bits
+    levels = (np.arange(1 << bits) << shift) + (1 << shift >> 1)
+    b, g, r = np.meshgrid(levels, levels, levels, indexing="ij")
+    return np.stack([b, g, r], axis=-1).reshape(-1, 1, 3).astype(np.uint8)
+
+def default_lut(bits=lut_bits, saturation=lut_saturation):
+    '''
+    LUT that reproduces the HSV rules of classify_pieces: nearest piece hue,
+    value above 128 for white and saturation for the rim.
+    '''
+    hsv = cv2.cvtColor(cell_colors(bits), cv2.COLOR_BGR2HSV).reshape(-1, 3)
+    types = np.argmin(hue_distance(hsv[:, 0, None], piece_hues[None, :]), axis=1) + 1
+    lut = types | np.where(hsv[:, 2] > 128, light_bit, 0) | np.where(hsv[:, 1] >= saturation, colored_bit, 0)
+    side = 1 << bits
+    return lut.astype(np.uint8).reshape(side, side, side)
+
+def square_votes(board, chess_grid, saturation=lut_saturation):
+    '''
+    Labeled pixels of a rectified board whose contents are chess_grid.
+    Returns (pixels, labels) pairs for the rim type, colored and light
+    votes. Saturated pixels on occupied squares are rims of that piece, the
+    middle of an occupied square is the piece's center, and every pixel of
+    an empty square is uncolored.
+    '''
+    square = board.shape[0] // 8
+    span = max(square // 8, 1)
+    middle = square // 2
+    hsv = cv2.cvtColor(board, cv2.COLOR_BGR2HSV)
+    type_pixels, type_labels = [], []
+    colored_pixels, colored_labels = [], []
+    light_pixels, light_labels = [], []
+    for row in range(8):
+        for col in range(8):
+            block = np.s_[row * square:(row + 1) * square, col * square:(col + 1) * square]
+            pixels = board[block].reshape(-1, 3)
+            symbol = chess_grid[row, col]
+            if symbol == ' ':
+                colored_pixels.append(pixels)
+                colored_labels.append(np.zeros(len(pixels), dtype=np.intp))
+                continue
+            rim = hsv[block][..., 1].reshape(-1) >= saturation
+            type_pixels.append(pixels[rim])
+            type_labels.append(np.full(rim.sum(), np.flatnonzero(piece_types == symbol.lower())[0]))
+            colored_pixels.append(pixels)
+            colored_labels.append(rim.astype(np.intp))
+            center = board[block][middle - span:middle + span, middle - span:middle + span].reshape(-1, 3)
+            light_pixels.append(center)
+            light_labels.append(np.full(len(center), int(symbol.isupper())))
+    return [
+        (np.concatenate(pixels), np.concatenate(labels))
+        for pixels, labels in ((type_pixels, type_labels), (colored_pixels, colored_labels),
+                               (light_pixels, light_labels))
+    ]
+
+def count_votes(pixels, labels, classes, bits=lut_bits):
+    cells = np.ravel_multi_index(lut_index(pixels, bits), (1 << bits,) * 3)
+    votes = np.zeros((1 << 3 * bits, classes), dtype=np.int64)
+    np.add.at(votes, (cells, labels), 1)
+    return votes
+
+def build_lut(boards, grids, bits=lut_bits, saturation=lut_saturation):
+    '''
+    Builds a LUT from rectified boards and their known chess_grids. Every
+    cell seen in training takes the majority of its votes, the others keep
+    the default_lut rule.
+    '''
+    lut = default_lut(bits, saturation).reshape(-1)
+    totals = None
+    for board, chess_grid in zip(boards, grids):
+        votes = [
+            count_votes(pixels, labels, classes, bits)
+            for (pixels, labels), classes in zip(square_votes(board, chess_grid, saturation),
+                                                 (len(piece_types), 2, 2))
+        ]
+        totals = votes if totals is None else [a + b for a, b in zip(totals, votes)]
+    if totals is None:
+        raise ValueError("No training boards given")
+    for votes, bit in ((totals[1], colored_bit), (totals[2], light_bit)):
+        seen = votes.sum(axis=1) > 0
+        lut[seen] = np.where(votes[seen, 1] > votes[seen, 0], lut[seen] | bit, lut[seen] & (0xFF ^ bit))
+    types = totals[0]
+    seen = types.sum(axis=1) > 0
+    lut[seen] = (lut[seen] & (0xFF ^ type_mask)) | (np.argmax(types[seen], axis=1) + 1)
+    side = 1 << bits
+    return lut.reshape(side, side, side)
+
+def save_lut(lut, path=lut_path):
+    np.save(path, lut)
+
+def load_lut(path=lut_path):
+    '''
+    Memory maps a stored LUT, or returns None if none has been built yet.
+    '''
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+def classify_pieces_lut(image, circles, lut, split_rim=False):
+    '''
+    classify_pieces for a BGR (or BGRA) frame through a LUT: the first rim
+    sample whose color is a rim color gives the piece type and the center
+    the side, with no HSV conversion.
+    '''
+    circles = np.asarray(circles).reshape(-1, 3).astype(np.intp)
+    if not len(circles):
+        return np.empty(0, dtype=str)
+    bits = lut.shape[0].bit_length() - 1
+    rim, center = rim_samples(image.shape, circles, split_rim)
+    rim_class = lut[lut_index(image[rim], bits)]
+    best = np.argmax(rim_class & colored_bit, axis=1)
+    types = piece_types[(rim_class[np.arange(len(circles)), best] & type_mask) - 1]
+    light = lut[lut_index(image[center], bits)] & light_bit
+    return np.where(light > 0, np.char.upper(types), types)
+
+def grid_from_lut(image, circles, lut, board, split_rim=False):
+    chess_grid = empty_grid()
+    if len(circles):
+        chess_grid[piece_coordinate(circles, board)] = classify_pieces_lut(image, circles, lut, split_rim)
+    return chess_grid
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the color lookup table from start position pictures")
+    parser.add_argument("images", nargs="*", default=training_images,
+                        help="pictures of the board set up in the starting position")
+    parser.add_argument("--bits", type=int, default=lut_bits)
+    parser.add_argument("--size", type=int, default=board_size)
+    parser.add_argument("--out", default=lut_path)
+    args = parser.parse_args()
+
+    boards = []
+    for path in args.images:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Error: {path} not found or could not be loaded")
+            raise SystemExit(1)
+        homography = board_homography(image, size=args.size)
+        if homography is None:
+            print(f"Error: Board not found in {path}")
+            raise SystemExit(1)
+        boards.append(rectify(image, homography, args.size))
+    start = board_grid(chess.Board())
+    lut = build_lut(boards, [start] * len(boards), args.bits)
+    save_lut(lut, args.out)
+    print(f"Saved {lut.shape[0]}^3 table to {args.out}")
@@ -0,0 +1,279 @@
+from functools import partial
+
+import cv2
+import numpy as np
+
+from piece_classifier import classify_pieces, classify_hues, hue_range
+
+# Experiment with thresholds once we have real pictures
+# Saturation of lower bound might need to be increased
+color_threshold_lower = (0, 10, 0)
+color_threshold_upper = (255, 255, 255)
+
+hough_params = {
+    "dp": 1,
+    "minDist": 20,
+    "param1": 20,
+    "param2": 10,
+    "minRadius": 15,
+    "maxRadius": 30,
+}
+
+# Pyramid levels to halve the mask by before the coarse HoughCircles pass
+pyramid_levels = 1
+# Extra pixels around each coarse circle searched at full resolution
+refine_margin = 4
+
+# Rows each band of find_circles_bands reaches past the largest radius
+band_margin = 4
+
+# Shape limits of a piece blob for the connected components engine: the
+# fraction of its bounding box it covers and the short to long side ratio
+blob_min_fill = 0.15
+blob_min_aspect = 0.75
+
+# Pixels per square when the board is resampled for the tile engine
+tile_size = 32
+# Fraction of a square that has to be saturated for it to count as occupied
+tile_fill = 0.08
+
+def empty_grid():
+    return np.full((8,8), ' ', dtype=str)
+
+def saturation_mask(hsv, lower=color_threshold_lower, upper=color_threshold_upper):
+    '''
+    Returns a single channel image that is black where the frame is colored
+    (a piece) and white everywhere else.
+    '''
+    return cv2.bitwise_not(cv2.inRange(hsv, lower, upper))
+
+def find_circles(mask, blur=None, **params):
+    '''
+    Runs HoughCircles over a saturation mask and returns an (N, 3) array of
+    (x, y, r) rows sorted by x then y. blur is an optional
+    (kernel size, sigma) pair applied before detection.
+    '''
+    if blur is not None:
+        ksize, sigma = blur
+        mask = cv2.GaussianBlur(mask, ksize, sigma)
+    circles = cv2.HoughCircles(mask, cv2.HOUGH_GRADIENT, **{**hough_params, **params})
+    if circles is None:
+        return np.empty((0, 3), dtype=np.uint16)
+    circles = np.uint16(np.around(circles[0]))
+    return circles[np.lexsort((circles[:, 1], circles[:, 0]))]
+
+def band_rows(height, bands, overlap=0):
+    '''
+    Splits height rows into (start, end, top, bottom) bands: rows
+    [start, end) belong to the band and [top, bottom) is what it reads,
+    overlap rows further on each side.
+    '''
+    edges = np.linspace(0, height, bands + 1).astype(int)
+    return [
+        (start, end, max(start - overlap, 0), min(end + overlap, height))
+        for start, end in zip(edges[:-1], edges[1:])
+    ]
+
+def merge_circles(circles, min_dist):
+    '''
+    Keeps one of every group of circles closer than min_dist, as
+    HoughCircles itself does within one image.
+    '''
+    kept = []
+    for circle in circles:
+        if all(np.hypot(circle[0] - other[0], circle[1] - other[1]) >= min_dist for other in kept):
+            kept.append(circle)
+    return np.array(kept, dtype=np.float64).reshape(-1, 3)
+
+def find_circles_bands(mask, executor, bands, **params):
+    '''
+    find_circles over horizontal bands of the mask in parallel. Each band
+    overlaps its neighbours by the largest radius, so a piece on a band edge
+    is whole in at least one band, and the detections it gives twice are
+    merged. OpenCV releases the GIL, so executor can be a thread pool.
+    '''
+    params = {**hough_params, **params}
+    overlap = int(np.ceil(params["maxRadius"])) + band_margin
+    reach = params["minDist"] / 2
+
+    def band(rows):
+        start, end, top, bottom = rows
+        circles = find_circles(mask[top:bottom], **params).astype(np.float64)
+        circles[:, 1] += top
+        # Leave detections owned by a neighbour to it, but keep the ones
+        # near the boundary from both sides for the merge
+        return circles[(circles[:, 1] >= start - reach) & (circles[:, 1] < end + reach)]
+
+    found = list(executor.map(band, band_rows(mask.shape[0], bands, overlap)))
+    circles = merge_circles(np.concatenate(found), params["minDist"])
+    circles = np.uint16(np.around(circles))
+    return circles[np.lexsort((circles[:, 1], circles[:, 0]))]
+
+def scaled_params(params, scale):
+    params = {**hough_params, **params}
+    params["minDist"] = params["minDist"] / scale
+    params["minRadius"] = max(int(params["minRadius"] / scale), 1)
+    params["maxRadius"] = int(np.ceil(params["maxRadius"] / scale))
+    return params
+
+def refine_circle(mask, circle, scale, margin=refine_margin, **params):
+    '''
+    Re-runs HoughCircles in a small full resolution window around a circle
+    found at 1/scale resolution. Falls back to the scaled up coarse circle if
+    the window does not confirm it.
+    '''
+    x, y, r = (float(a) * scale for a in circle)
+    params = {**hough_params, **params}
+    reach = int(r + scale + margin)
+    left, top = max(int(x) - reach, 0), max(int(y) - reach, 0)
+    window = mask[top:int(y) + reach + 1, left:int(x) + reach + 1]
+    params["minDist"] = max(window.shape)
+    params["minRadius"] = max(int(r - scale), 1)
+    params["maxRadius"] = int(r + scale) + 1
+    found = cv2.HoughCircles(window, cv2.HOUGH_GRADIENT, **params)
+    if found is None:
+        return x, y, r
+    fx, fy, fr = found[0][0]
+    if abs(fx + left - x) > scale or abs(fy + top - y) > scale:
+        return x, y, r
+    return fx + left, fy + top, fr
+
+def find_circles_pyramid(mask, blur=None, levels=pyramid_levels, **params):
+    '''
+    Coarse-to-fine version of find_circles. Candidates come from
+    HoughCircles on the mask shrunk by 2 ** levels, then each one is refined
+    in a window of the full resolution mask. The pieces are large enough that
+    the coarse pass loses almost nothing, and Hough cost grows with pixels.
+    '''
+    if blur is not None:
+        ksize, sigma = blur
+        mask = cv2.GaussianBlur(mask, ksize, sigma)
+    small = mask
+    for _ in range(levels):
+        small = cv2.pyrDown(small)
+    scale = 2 ** levels
+    coarse = find_circles(small, **scaled_params(params, scale))
+    if not len(coarse):
+        return coarse
+    circles = np.array([refine_circle(mask, circle, scale, **params) for circle in coarse])
+    circles = np.uint16(np.around(circles))
+    return circles[np.lexsort((circles[:, 1], circles[:, 0]))]
+
+def piece_coordinate(circles, board):
+    '''
+    Maps (x, y, r) rows to (row, col) square indices. board is the
+    (left, top, right, bottom) pixel box of the 8x8 squares in the frame.
+    '''
+    left, top, right, bottom = board
+    circles = np.asarray(circles).reshape(-1, 3).astype(np.intp)
+    rows = (circles[:, 1] - top) * 8 // (bottom - top)
+    cols = (circles[:, 0] - left) * 8 // (right - left)
+    return np.clip(rows, 0, 7), np.clip(cols, 0, 7)
+
+def grid_from_circles(hsv, circles, board, split_rim=False):
+    chess_grid = empty_grid()
+    if len(circles):
+        chess_grid[piece_coordinate(circles, board)] = classify_pieces(hsv, circles, split_rim)
+    return chess_grid
+
+def detect_hough(image, board, hsv=None, lower=color_threshold_lower,
+                 upper=color_threshold_upper, blur=None, split_rim=False, levels=0, **params):
+    '''
+    Finds pieces with HoughCircles on the whole frame, or coarse-to-fine
+    over a pyramid when levels is set.
+    '''
+    if hsv is None:
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    mask = saturation_mask(hsv, lower, upper)
+    if levels:
+        circles = find_circles_pyramid(mask, blur, levels, **params)
+    else:
+        circles = find_circles(mask, blur, **params)
+    return grid_from_circles(hsv, circles, board, split_rim)
+
+def find_blobs(mask, min_radius=hough_params["minRadius"], max_radius=hough_params["maxRadius"],
+               min_fill=blob_min_fill, min_aspect=blob_min_aspect):
+    '''
+    Finds pieces as connected components of the colored (black) pixels of
+    a saturation mask, in a single pass instead of Hough voting. Blobs
+    whose bounding box is square enough, covered enough and within the
+    radius limits become (x, y, r) rows, sorted like find_circles.
+    '''
+    _, _, stats, _ = cv2.connectedComponentsWithStats(cv2.bitwise_not(mask), connectivity=8)
+    # Label 0 is the uncolored background
+    left, top, width, height, area = stats[1:].T
+    radius = (width + height) / 4
+    keep = (
+        (radius >= min_radius) & (radius <= max_radius)
+        & (np.minimum(width, height) >= min_aspect * np.maximum(width, height))
+        & (area >= min_fill * width * height)
+    )
+    # The box center stays on the piece when part of its rim is missing
+    circles = np.column_stack([left + width / 2, top + height / 2, radius])[keep]
+    circles = np.uint16(np.around(circles))
+    return circles[np.lexsort((circles[:, 1], circles[:, 0]))]
+
+def detect_blobs(image, board, hsv=None, lower=color_threshold_lower,
+                 upper=color_threshold_upper, split_rim=False, **_):
+    '''
+    Finds pieces with connected components of the saturation mask. Its
+    cost is one pass over the mask whatever the parameters.
+    '''
+    if hsv is None:
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    circles = find_blobs(saturation_mask(hsv, lower, upper))
+    return grid_from_circles(hsv, circles, board, split_rim)
+
+def board_tiles(image, board, size=tile_size):
+    '''
+    Resamples the board box to 8 * size pixels square and returns it as an
+    (8, size, 8, size, channels) view, one block per square.
+    '''
+    left, top, right, bottom = board
+    region = image[max(top, 0):bottom, max(left, 0):right]
+    region = cv2.resize(region, (8 * size, 8 * size), interpolation=cv2.INTER_AREA)
+    return region.reshape(8, size, 8, size, -1)
+
+def detect_tiles(image, board, hsv=None, lower=color_threshold_lower,
+                 upper=color_threshold_upper, size=tile_size, fill=tile_fill, **_):
+    '''
+    Finds pieces by reducing each square of the board to its saturated
+    fraction, mean hue of the saturated pixels and center value. Much
+    cheaper than HoughCircles since it only looks at the resampled board.
+    '''
+    tiles = board_tiles(image, board, size)
+    hsv = cv2.cvtColor(tiles.reshape(8 * size, 8 * size, -1)[:, :, :3], cv2.COLOR_BGR2HSV)
+    tiles = hsv.reshape(8, size, 8, size, 3)
+    saturated = cv2.inRange(hsv, lower, upper).reshape(8, size, 8, size) > 0
+    counts = saturated.sum(axis=(1, 3))
+    occupied = counts > fill * size * size
+
+    # Hue is an angle, so average it as a unit vector
+    angle = tiles[..., 0] * (2 * np.pi / hue_range)
+    hue_x = np.where(saturated, np.cos(angle), 0).sum(axis=(1, 3))
+    hue_y = np.where(saturated, np.sin(angle), 0).sum(axis=(1, 3))
+    mean_hue = np.round(np.arctan2(hue_y, hue_x) * hue_range / (2 * np.pi)) % hue_range
+
+    center = size // 2
+    span = max(size // 8, 1)
+    center_val = tiles[:, center - span:center + span, :, center - span:center + span, 2].mean(axis=(1, 3))
+
+    chess_grid = empty_grid()
+    if occupied.any():
+        chess_grid[occupied] = classify_hues(mean_hue[occupied], center_val[occupied])
+    return chess_grid
+
+engines = {
+    "hough": detect_hough,
+    "tiles": detect_tiles,
+    "pyramid": partial(detect_hough, levels=pyramid_levels),
+    "components": detect_blobs,
+}
+
+def detect_board(image, board, engine="hough", **kwargs):
+    '''
+    Runs the named detection engine and returns the 8x8 chess_grid.
+    '''
+    if engine not in engines:
+        raise ValueError(f"Unknown detection engine: {engine}")
+    return engines[engine](image, board, **kwargs)
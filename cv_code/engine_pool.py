@@ -0,0 +1,263 @@
+import asyncio
+import sys
+import threading
+
+import chess
+import chess.engine
+
+stockfish_path = "./stockfish/src/stockfish"
+# Warm engine processes, each serves one board at a time
+pool_size = 2
+# Think time when a request gives no limit of its own
+default_limit = chess.engine.Limit(time=0.1)
+# Seconds an idle engine may take to answer isready before it is restarted
+ping_timeout = 2.0
+# Seconds a search without a time limit, e.g. to a fixed depth, may run
+# before its engine is taken as hung and restarted
+hang_timeout = 30.0
+# Seconds between health checks of the idle engines
+health_interval = 10.0
+# Stands in for Stockfish where it is not installed
+fake_engine = [sys.executable, "./scripts/fake_uci.py"]
+
+def search_limit(limit=None, time=None, depth=None, nodes=None):
+    '''
+    A chess.engine.Limit from a limit or its time/depth/nodes parts, None if
+    neither is given.
+    '''
+    if limit is not None:
+        return limit
+    if time is None and depth is None and nodes is None:
+        return None
+    return chess.engine.Limit(time=time, depth=depth, nodes=nodes)
+
+class EnginePool:
+    '''
+    A fixed number of warm UCI engine processes behind one asyncio API.
+    Requests take whichever engine is idle, so boards searched at the same
+    time do not wait for each other. An engine that crashes or stops
+    answering is replaced and the request retried once on the new process.
+
+    Attributes:
+        command;    str or list;            UCI engine command
+        size;       int;                    number of engine processes
+        limit;      chess.engine.Limit;     search limit of requests without their own
+        options;    dict;                   UCI options set on every engine
+        idle;       asyncio.Queue;          engines not serving a request
+        engines;    list;                   every open (transport, engine) pair
+        restarts;   int;                    engines replaced since start()
+        cache;      MoveCache;              results consulted before searching, None for none
+        hang_timeout; float;                seconds a search without a time limit may take
+    '''
+
+    def __init__(self, command=stockfish_path, size=pool_size, limit=default_limit, options=None,
+                 ping_timeout=ping_timeout, health_interval=health_interval, cache=None,
+                 hang_timeout=hang_timeout):
+        self.command = command
+        self.size = size
+        self.limit = limit
+        self.options = options or {}
+        self.cache = cache
+        self.ping_timeout = ping_timeout
+        self.hang_timeout = hang_timeout
+        self.health_interval = health_interval
+        self.idle = None
+        self.engines = []
+        self.restarts = 0
+        self.health = None
+
+    async def open_engine(self):
+        transport, engine = await chess.engine.popen_uci(self.command)
+        if self.options:
+            await engine.configure(self.options)
+        self.engines.append((transport, engine))
+        return engine
+
+    async def close_engine(self, engine):
+        for entry in self.engines:
+            if entry[1] is engine:
+                self.engines.remove(entry)
+                transport = entry[0]
+                break
+        else:
+            return
+        try:
+            await asyncio.wait_for(engine.quit(), self.ping_timeout)
+        except (asyncio.TimeoutError, chess.engine.EngineError):
+            transport.close()
+            await engine.returncode
+
+    async def restart(self, engine):
+        await self.close_engine(engine)
+        self.restarts += 1
+        return await self.open_engine()
+
+    async def start(self):
+        '''
+        Opens all engines at once and starts the periodic health check.
+        '''
+        self.idle = asyncio.Queue()
+        for engine in await asyncio.gather(*(self.open_engine() for _ in range(self.size))):
+            self.idle.put_nowait(engine)
+        if self.health_interval:
+            self.health = asyncio.create_task(self.check_forever())
+        return self
+
+    async def healthy(self, engine):
+        if engine.returncode.done():
+            return False
+        try:
+            await asyncio.wait_for(engine.ping(), self.ping_timeout)
+        except (asyncio.TimeoutError, chess.engine.EngineError):
+            return False
+        return True
+
+    async def check(self):
+        '''
+        Pings the engines that are idle right now and restarts the ones that
+        do not answer. Returns how many were restarted.
+        '''
+        restarted = 0
+        for _ in range(self.idle.qsize()):
+            engine = self.idle.get_nowait()
+            try:
+                if not await self.healthy(engine):
+                    engine = await self.restart(engine)
+                    restarted += 1
+            finally:
+                self.idle.put_nowait(engine)
+        return restarted
+
+    async def check_forever(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check()
+            except (OSError, chess.engine.EngineError) as error:
+                print(f"Warning: engine health check failed: {error}", file=sys.stderr)
+
+    def timeout(self, limit):
+        '''
+        Seconds after which a search under limit is given up as hung: its
+        time limit plus ping_timeout, or hang_timeout without a time limit.
+        '''
+        return limit.time + self.ping_timeout if limit.time is not None else self.hang_timeout
+
+    async def run(self, search, timeout=None):
+        '''
+        Awaits search(engine) on an idle engine. If the engine dies or hangs
+        during the search it is restarted and the search retried once.
+        '''
+        engine = await self.idle.get()
+        try:
+            try:
+                return await asyncio.wait_for(search(engine), timeout)
+            except (asyncio.TimeoutError, chess.engine.EngineError):
+                if await self.healthy(engine):
+                    raise
+                engine = await self.restart(engine)
+                return await asyncio.wait_for(search(engine), timeout)
+        finally:
+            self.idle.put_nowait(engine)
+
+    async def play(self, board, limit=None, time=None, depth=None, nodes=None):
+        '''
+        The engine's chess.engine.PlayResult for a position, from the cache
+        if it has been searched before. The limit, or its time/depth/nodes
+        parts, overrides the pool's limit.
+        '''
+        limit = search_limit(limit, time, depth, nodes) or self.limit
+        if self.cache is None:
+            board = board.copy()
+            return await self.run(lambda engine: engine.play(board, limit), self.timeout(limit))
+        result = await self.cache.lookup(board, limit)
+        if result is not None:
+            return result
+        board = board.copy()
+        info = chess.engine.INFO_BASIC | chess.engine.INFO_SCORE
+        result = await self.run(lambda engine: engine.play(board, limit, info=info), self.timeout(limit))
+        self.cache.store(board, limit, result)
+        return result
+
+    async def best_move(self, board, limit=None, time=None, depth=None, nodes=None):
+        return (await self.play(board, limit, time, depth, nodes)).move
+
+    async def analyse(self, board, limit=None, multipv=None):
+        '''
+        The engine's chess.engine.InfoDict for a position, or a list of them
+        best first if multipv is given.
+        '''
+        limit = limit or self.limit
+        board = board.copy()
+        return await self.run(lambda engine: engine.analyse(board, limit, multipv=multipv), self.timeout(limit))
+
+    async def close(self):
+        if self.health is not None:
+            self.health.cancel()
+            self.health = None
+        await asyncio.gather(*(self.close_engine(engine) for _, engine in list(self.engines)))
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+class EngineThread:
+    '''
+    Runs an EnginePool on its own event loop thread, for synchronous code
+    such as the camera loop. Calls block only the caller; submit() returns
+    a concurrent.futures.Future instead.
+
+    Attributes:
+        pool;       EnginePool;                 the pool being served
+        loop;       asyncio.AbstractEventLoop;  event loop of the pool's thread
+        speculator; Speculator;                 answers the human's likely moves ahead, None for none
+    '''
+
+    def __init__(self, pool, speculator=None):
+        self.pool = pool
+        self.speculator = speculator
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="engine-pool", daemon=True)
+        self.thread.start()
+        try:
+            self.submit(pool.start()).result()
+        except BaseException:
+            self.submit(pool.close()).result()
+            self.stop()
+            raise
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def best_move(self, board, limit=None, time=None, depth=None, nodes=None):
+        return self.submit(self.pool.best_move(board.copy(), limit, time, depth, nodes)).result()
+
+    def speculate(self, board):
+        '''
+        Starts answering the human's likely moves in the position they have
+        to move in. Returns at once.
+        '''
+        if self.speculator is not None:
+            self.loop.call_soon_threadsafe(self.speculator.speculate, board.copy())
+
+    def answer(self, board):
+        '''
+        The engine's chess.engine.PlayResult for the position after the
+        human's move, from the speculation when the move was predicted.
+        '''
+        if self.speculator is None:
+            return self.submit(self.pool.play(board.copy())).result()
+        return self.submit(self.speculator.answer(board.copy())).result()
+
+    def close(self):
+        if self.speculator is not None:
+            self.loop.call_soon_threadsafe(self.speculator.discard)
+        self.submit(self.pool.close()).result()
+        self.stop()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -0,0 +1,239 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import cv2
+
+from detectors import color_threshold_lower, color_threshold_upper, empty_grid, find_circles
+from detectors import band_rows, find_circles_bands, grid_from_circles, piece_coordinate
+from piece_classifier import classify_pieces_yuv
+from color_lut import grid_from_lut
+
+class FramePipeline:
+    '''
+    Rectify, HSV, mask and blur stages writing into buffers allocated once
+    for the camera mode, so a frame costs no large allocations.
+
+    Attributes:
+        size;       tuple;      (width, height) of the processed image
+        frame;      ndarray;    rectified frame, as many channels as the camera gives
+        board;      ndarray;    BGR copy of frame for 4 channel cameras
+        source;     ndarray;    BGR board of the last rectified frame
+        hsv;        ndarray;    HSV conversion of board
+        mask;       ndarray;    colored pixels black, everything else white
+        blurred;    ndarray;    blurred mask handed to HoughCircles
+        lut;        ndarray;    color lookup table to classify pieces with, None for HSV
+        bands;      int;        horizontal bands processed in parallel threads, 1 for none
+        maps;       tuple;      fixed-point undistort and rectify remap maps, None to warp
+    '''
+
+    def __init__(self, size, lower=color_threshold_lower, upper=color_threshold_upper,
+                 blur=None, channels=3, lut=None, bands=1, maps=None):
+        if isinstance(size, int):
+            size = (size, size)
+        self.size = size
+        self.lower = np.array(lower, dtype=np.uint8)
+        self.upper = np.array(upper, dtype=np.uint8)
+        self.blur = blur
+        width, height = size
+        self.frame = np.empty((height, width, channels), dtype=np.uint8)
+        self.board = np.empty((height, width, 3), dtype=np.uint8) if channels == 4 else self.frame
+        self.hsv = np.empty((height, width, 3), dtype=np.uint8)
+        self.mask = np.empty((height, width), dtype=np.uint8)
+        self.blurred = np.empty((height, width), dtype=np.uint8) if blur else self.mask
+        self.source = self.board
+        self.lut = lut
+        self.maps = maps
+        self.bands = bands
+        self.executor = ThreadPoolExecutor(bands) if bands > 1 else None
+        # The blur reads half a kernel past its band
+        self.rows = band_rows(height, bands, blur[0][1] // 2 if blur else 0)
+
+    def rectify(self, image, homography=None):
+        '''
+        Warps a frame to the top-down board and drops the alpha channel.
+        Returns a BGR view that the following stages read from. The remap
+        maps, when there are any, replace the homography.
+        '''
+        if self.maps is not None:
+            image = cv2.remap(image, *self.maps, cv2.INTER_LINEAR, dst=self.frame)
+        elif homography is not None:
+            image = cv2.warpPerspective(image, homography, self.size, dst=self.frame)
+        if image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR, dst=self.board)
+        self.source = image
+        return image
+
+    def process(self):
+        '''
+        HSV, mask and blur stages over the last rectified frame.
+        '''
+        if self.executor is not None:
+            # The blur of a band reads the mask of its neighbours, so all
+            # masks are finished first
+            list(self.executor.map(self.mask_band, self.rows))
+            if self.blur:
+                list(self.executor.map(self.blur_band, self.rows))
+            return self.source, self.hsv, self.mask
+        cv2.cvtColor(self.source, cv2.COLOR_BGR2HSV, dst=self.hsv)
+        cv2.inRange(self.hsv, self.lower, self.upper, dst=self.mask)
+        cv2.bitwise_not(self.mask, dst=self.mask)
+        if self.blur:
+            ksize, sigma = self.blur
+            cv2.GaussianBlur(self.mask, ksize, sigma, dst=self.blurred)
+        return self.source, self.hsv, self.mask
+
+    def mask_band(self, rows):
+        start, end, _, _ = rows
+        cv2.cvtColor(self.source[start:end], cv2.COLOR_BGR2HSV, dst=self.hsv[start:end])
+        cv2.inRange(self.hsv[start:end], self.lower, self.upper, dst=self.mask[start:end])
+        cv2.bitwise_not(self.mask[start:end], dst=self.mask[start:end])
+
+    def blur_band(self, rows):
+        start, end, top, bottom = rows
+        ksize, sigma = self.blur
+        blurred = cv2.GaussianBlur(self.mask[top:bottom], ksize, sigma)
+        self.blurred[start:end] = blurred[start - top:end - top]
+
+    def run(self, image, homography=None):
+        '''
+        Processes one frame and returns (board, hsv, mask) views of the
+        pipeline's buffers, valid until the next call.
+        '''
+        self.rectify(image, homography)
+        return self.process()
+
+    def detect(self, image, homography=None, split_rim=False, **params):
+        '''
+        Runs the HoughCircles engine through the buffers. Returns the
+        chess_grid and the detected circles.
+        '''
+        self.run(image, homography)
+        return self.recognize(split_rim, **params)
+
+    def recognize(self, split_rim=False, **params):
+        '''
+        Detection and classification over the last processed frame.
+        '''
+        if self.executor is not None:
+            circles = find_circles_bands(self.blurred, self.executor, self.bands, **params)
+        else:
+            circles = find_circles(self.blurred, **params)
+        box = (0, 0) + self.size
+        if self.lut is not None:
+            return grid_from_lut(self.source, circles, self.lut, box, split_rim), circles
+        return grid_from_circles(self.hsv, circles, box, split_rim), circles
+
+# Chroma (|U - 128| + |V - 128|) above which a pixel counts as colored
+chroma_threshold = 24
+
+def yuv420_planes(buffer, width=None):
+    '''
+    Zero-copy Y, U and V views of a YUV420 (I420) capture of shape
+    (height * 3 / 2, stride). Each chroma row takes half a buffer row.
+    '''
+    height = buffer.shape[0] * 2 // 3
+    stride = buffer.shape[1]
+    width = width or stride
+    quarter = height // 4
+    luma = buffer[:height, :width]
+    u = buffer[height:height + quarter].reshape(height // 2, stride // 2)[:, :width // 2]
+    v = buffer[height + quarter:height + 2 * quarter].reshape(height // 2, stride // 2)[:, :width // 2]
+    return luma, u, v
+
+class YuvPipeline:
+    '''
+    FramePipeline for YUV420 captures. The occupancy mask and piece colors
+    come straight from the chroma planes, so the frame is never converted
+    to BGR or HSV. The half resolution chroma planes are warped directly
+    onto the full size board.
+
+    Attributes:
+        size;       tuple;      (width, height) of the processed image
+        luma;       ndarray;    rectified Y plane
+        u, v;       ndarray;    rectified chroma planes
+        chroma;     ndarray;    |U - 128| + |V - 128|
+        mask;       ndarray;    colored pixels black, everything else white
+        blurred;    ndarray;    blurred mask handed to HoughCircles
+        maps;       tuple;      fixed-point undistort and rectify remap maps, None to warp
+    '''
+
+    def __init__(self, size, threshold=chroma_threshold, blur=None, maps=None):
+        if isinstance(size, int):
+            size = (size, size)
+        self.size = size
+        self.threshold = threshold
+        self.blur = blur
+        width, height = size
+        self.luma, self.u, self.v, self.du, self.dv, self.chroma, self.mask = (
+            np.empty((height, width), dtype=np.uint8) for _ in range(7)
+        )
+        self.neutral = np.full((height, width), 128, dtype=np.uint8)
+        self.blurred = np.empty((height, width), dtype=np.uint8) if blur else self.mask
+        # Chroma pixel (x, y) sits at (2x, 2y) in the full frame
+        self.chroma_scale = np.diag([2.0, 2.0, 1.0])
+        self.maps = maps
+        if maps is not None:
+            map_x, map_y = cv2.convertMaps(*maps, cv2.CV_32FC1)
+            self.chroma_maps = cv2.convertMaps(map_x / 2, map_y / 2, cv2.CV_16SC2)
+
+    def rectify(self, buffer, homography=None, width=None):
+        '''
+        Warps the three planes of a YUV420 capture to the board. Returns the
+        rectified Y plane.
+        '''
+        luma, u, v = yuv420_planes(buffer, width)
+        if self.maps is not None:
+            cv2.remap(luma, *self.maps, cv2.INTER_LINEAR, dst=self.luma)
+            cv2.remap(u, *self.chroma_maps, cv2.INTER_LINEAR, dst=self.u)
+            cv2.remap(v, *self.chroma_maps, cv2.INTER_LINEAR, dst=self.v)
+        elif homography is not None:
+            cv2.warpPerspective(luma, homography, self.size, dst=self.luma)
+            chroma_homography = homography @ self.chroma_scale
+            cv2.warpPerspective(u, chroma_homography, self.size, dst=self.u)
+            cv2.warpPerspective(v, chroma_homography, self.size, dst=self.v)
+        else:
+            np.copyto(self.luma, luma)
+            cv2.resize(u, self.size, dst=self.u)
+            cv2.resize(v, self.size, dst=self.v)
+        return self.luma
+
+    def process(self):
+        '''
+        Chroma mask and blur stages over the last rectified planes.
+        '''
+        cv2.absdiff(self.u, self.neutral, dst=self.du)
+        cv2.absdiff(self.v, self.neutral, dst=self.dv)
+        cv2.add(self.du, self.dv, dst=self.chroma)
+        cv2.threshold(self.chroma, self.threshold, 255, cv2.THRESH_BINARY_INV, dst=self.mask)
+        if self.blur:
+            ksize, sigma = self.blur
+            cv2.GaussianBlur(self.mask, ksize, sigma, dst=self.blurred)
+        return self.luma, self.chroma, self.mask
+
+    def run(self, buffer, homography=None, width=None):
+        '''
+        Processes one YUV420 capture and returns (luma, chroma, mask) views
+        of the pipeline's buffers, valid until the next call.
+        '''
+        self.rectify(buffer, homography, width)
+        return self.process()
+
+    def detect(self, buffer, homography=None, split_rim=False, width=None, **params):
+        '''
+        Runs the HoughCircles engine through the buffers. Returns the
+        chess_grid and the detected circles.
+        '''
+        self.run(buffer, homography, width)
+        return self.recognize(split_rim, **params)
+
+    def recognize(self, split_rim=False, **params):
+        '''
+        Detection and classification over the last processed planes.
+        '''
+        circles = find_circles(self.blurred, **params)
+        chess_grid = empty_grid()
+        if len(circles):
+            box = (0, 0) + self.size
+            chess_grid[piece_coordinate(circles, box)] = classify_pieces_yuv(
+                self.luma, self.u, self.v, circles, split_rim)
+        return chess_grid, circles
@@ -0,0 +1,124 @@
+import chess
+
+from board_state import BoardState
+from detectors import empty_grid
+
+# Occupancy mismatches tolerated on changed squares a move does not touch
+# before a frame is rejected
+max_mismatches = 1
+
+def board_grid(board):
+    chess_grid = empty_grid()
+    for square, piece in board.piece_map().items():
+        chess_grid[7 - chess.square_rank(square), chess.square_file(square)] = piece.symbol()
+    return chess_grid
+
+def grid_symbol(chess_grid, square):
+    # chess_grid row 0 is rank 8, column 0 is the a-file
+    return chess_grid[7 - chess.square_rank(square), chess.square_file(square)]
+
+def square_score(expected, observed):
+    '''
+    Agreement between the letter a move predicts for a square and the one
+    recognized there: 3 for the same piece, 2 for the same color, 1 for any
+    piece where a piece is expected, 0 for empty, -1 for wrong occupancy.
+    '''
+    if expected == observed:
+        return 3 if expected != ' ' else 0
+    if expected == ' ' or observed == ' ':
+        return -1
+    if expected.isupper() == observed.isupper():
+        return 2
+    return 1
+
+def touched_squares(board, move):
+    '''
+    Squares whose contents change when move is played.
+    '''
+    squares = {move.from_square, move.to_square}
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        kingside = chess.square_file(move.to_square) > chess.square_file(move.from_square)
+        squares.add(chess.square(7 if kingside else 0, rank))
+        squares.add(chess.square(5 if kingside else 3, rank))
+    elif board.is_en_passant(move):
+        squares.add(chess.square(chess.square_file(move.to_square), chess.square_rank(move.from_square)))
+    return squares
+
+class GameTracker:
+    '''
+    Follows a game by matching each recognized chess_grid against the legal
+    moves of the current position, so castling rights, side to move and move
+    counters stay correct and a noisy frame can still be accepted.
+
+    Attributes:
+        board;          chess.Board;    position after the last accepted move
+        max_mismatches; int;            occupancy errors tolerated off the move's squares
+    '''
+
+    def __init__(self, board=None, max_mismatches=max_mismatches):
+        self.board = board if board is not None else chess.Board()
+        self.max_mismatches = max_mismatches
+
+    def changed_squares(self, chess_grid):
+        state = BoardState.from_grid(chess_grid)
+        return set(state.changed_squares(BoardState.from_board(self.board)))
+
+    def score_move(self, move, chess_grid, changed):
+        '''
+        Scores a legal move over the changed squares plus the squares it
+        touches. Returns (score, occupancy mismatches on the squares it does
+        not touch), or None if a square it touches disagrees on occupancy.
+        '''
+        touched = touched_squares(self.board, move)
+        squares = changed | touched
+        self.board.push(move)
+        try:
+            expected = [self.board.piece_at(square) for square in squares]
+        finally:
+            self.board.pop()
+        score = mismatches = 0
+        for square, piece in zip(squares, expected):
+            points = square_score(piece.symbol() if piece else ' ', grid_symbol(chess_grid, square))
+            if points < 0:
+                # A missed or lifted piece on the move's own squares is not a move
+                if square in touched:
+                    return None
+                mismatches += 1
+            score += points
+        return score, mismatches
+
+    def match(self, chess_grid):
+        '''
+        Returns the legal move that best explains chess_grid, or None if the
+        board did not change or no move explains it.
+        '''
+        changed = self.changed_squares(chess_grid)
+        if not changed:
+            return None
+        best = None
+        best_score = 0
+        for move in self.board.legal_moves:
+            if not changed & touched_squares(self.board, move):
+                continue
+            scored = self.score_move(move, chess_grid, changed)
+            if scored is None:
+                continue
+            score, mismatches = scored
+            if mismatches > self.max_mismatches:
+                continue
+            if score > best_score:
+                best, best_score = move, score
+        return best
+
+    def update(self, chess_grid):
+        '''
+        Plays the move recognized in chess_grid, if any, and returns it.
+        '''
+        move = self.match(chess_grid)
+        if move is not None:
+            self.board.push(move)
+        return move
+
+    def fen(self):
+        return self.board.fen()
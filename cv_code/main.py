@@ -1,16 +1,22 @@
 import cv2
-import numpy as np
-import math
-from bisect import bisect
 
 import chess
-import chess.engine
-import time
 
 import os # only for demo
 
+from detectors import detect_board, find_circles, grid_from_circles
+from calibration import board_box, calibrate, load_calibration
+from frame_pipeline import FramePipeline
+from color_lut import grid_from_lut, load_lut
+from board_io import print_board
+from game_tracker import GameTracker
+from autotune import load_tuned
+from startup import Startup
+
 stockfish_path = "./stockfish/src/stockfish"
-engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+image_directory = "./images/chess_game_sequence/eight_colors"
+# Side the arm plays, the other side's moves come from the human
+robot_color = chess.BLACK
 
 # Setting chessboard grid dimension
 grid_dimension = (8,2)
@@ -23,111 +29,20 @@ higher_green = (80, 255, 255)
 color_threshold_lower = (0, 10, 0)
 color_threshold_upper= (255, 255, 255)
 
-black = (0, 0, 0)
-white = (255, 255, 255)
-blue = (82, 113, 255)
-green = (0, 191, 99)
-red = (255, 49, 49)
-pink = (255, 102, 196)
-orange = (255, 145, 77)
-yellow = (255, 222, 89)
-
-rows = [60, 120, 180, 240, 300, 360, 420, 480]
-cols = [140, 200, 260, 320, 380, 440, 500, 560]
-
-def get_hue(rgb_color):
-    rgb_array = np.uint8([[list(rgb_color)]])
-    hsv_array = cv2.cvtColor(rgb_array, cv2.COLOR_RGB2HSV)
-    hsv_color = tuple(hsv_array[0][0])
-    return hsv_color[0]
-
-hues = (
-    (get_hue(blue), 'p'),
-    (get_hue(green), 'b'),
-    (get_hue(red), 'k'),
-    (get_hue(pink), 'n'),
-    (get_hue(orange), 'q'),
-    (get_hue(yellow), 'r')
-)
-
-piece_icon = {
-    "K":u"♔",
-    "Q":u"♕",
-    "R":u"♖",
-    "B":u"♗",
-    "N":u"♘",
-    "P":u"♙",
-    "k":u"♚",
-    "q":u"♛",
-    "r":u"♜",
-    "b":u"♝",
-    "n":u"♞",
-    "p":u"♟"
-}
-
-def get_piece(image, circle):
-    x, y, r = (int(a) for a in circle)
-    piece_type_color = image[y+r-2][x]
-    #print(y+r-3, x)
-    #print(piece_type_color)
-    piece_type_hue = piece_type_color[0]
-    closest_type = 'p'
-    closest_dist = float('inf')
-    for hue, piece_type in hues:
-        dist = piece_type_hue - hue
-        if dist < closest_dist:
-            closest_dist = dist
-            closest_type = piece_type
-    piece_center_color = image[y][x]
-    piece_center_val = piece_center_color[2]
-    if piece_center_val > 128:
-        closest_type = closest_type.upper()
-    return closest_type
-
-def piece_coordinate(circle):
-    x, y, r = (int(a) for a in circle)
-    return (bisect(rows, y), bisect(cols, x))
-
-def generate_fen(chess_grid):
-    res = []
-    seperator = ''
-    for row in chess_grid:
-        res.append(seperator)
-        emptyCount = 0
-        for square in row:
-            if square == ' ':
-                emptyCount += 1
-            else:
-                if emptyCount:
-                    res.append(str(emptyCount))
-                    emptyCount = 0
-                res.append(square)
-        if emptyCount:
-            res.append(str(emptyCount))
-        seperator = "/"
-    res.append(" b KQkq - 0 1")
-    return ''.join(res)
-
-def print_board(board):
-    print()
-    print()
-    for i, row in enumerate(board):
-        print(8 - i, end=" ")
-        for j, square in enumerate(row):
-            if i % 2 == j % 2:
-                print('\033[30;47m ', end='')
-            else:
-                print('\033[30;100m ', end='')
-            if square in piece_icon:
-                print(piece_icon[square], end=' ')
-            else:
-                #print(u'■' if i % 2 == j % 2 else u'□', end=' ')
-                print('  ', end='')
-            print('\033[0m', end='')
-        print()
-    print('  a b c d e f g h')
-    print()
-    print()
+
+# Detection engine, "hough", "pyramid", "components" or "tiles"
+detector_engine = "hough"
+blur = None
+split_rim = False
+hough_settings = {}
+
+# Settings found by autotune.py for these images replace the hand-picked ones
+tuned = load_tuned("eight_colors")
+if tuned is not None:
+    color_threshold_lower = tuned["lower"]
+    blur = tuned["blur"]
+    split_rim = tuned["split_rim"]
+    hough_settings = tuned["hough"]
 
 # TODO: Create the color ranges for each chess piece
 
@@ -167,78 +82,156 @@ demo_moves = [
     "d1d8"
 ]
 
-images = sorted(os.listdir("./images/chess_game_sequence/eight_colors"))
-for move, image in zip(demo_moves + ["Checkmate!"], [images[33]] + images[15:33] + images[:15]):
-    # load the image
-    image = cv2.imread(f"./images/chess_game_sequence/eight_colors/{image}")
-    # break the loop if no image is found or loaded
-    if image is None:
-        print("Error: Image not found or could not be loaded")
-        break
-
-    # convert the image to HSV
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    # isolate the pixels based on the lower and upper bounds
-    mask_green = cv2.inRange(hsv, color_threshold_lower, color_threshold_upper)
-    # Green pixels = True, Not green = False
-    imask_green = mask_green>0
-    # Create new image setting everything that is not green white
-    green = np.full(image.shape, (255, 255, 255), dtype=np.uint8)
-    # Setting everything green to black
-    green[imask_green] = (0,0,0)
-
-    # blur the images, used for live image capture
-    blurred = cv2.GaussianBlur(green, (9,9), 2)
-
-    cv2.imshow('Detected Circles', green)
-    
-    # display images
-    # cv2.imshow('image.jpg', image)
-    # cv2.imshow('green.jpg', green)
-    # cv2.imshow('blurred.jpg', blurred)
-    
+def open_engine(path=stockfish_path):
+    # engine_pool pulls in asyncio, so it is only imported with the engine
+    from engine_pool import EnginePool, EngineThread
+    from move_cache import MoveCache
+    from speculation import Speculator
+    # The demo game repeats, its positions are answered from move_cache.sqlite
+    pool = EnginePool(path)
+    engine = EngineThread(pool, Speculator(pool))
+    # Opened once the engine is up, so a failed start leaves no file behind
+    try:
+        pool.cache = MoveCache()
+    except BaseException:
+        engine.close()
+        raise
+    return engine
+
+def board_calibration(startup):
+    # Find the board once and reuse the stored homography for every frame
+    image = cv2.imread(f"{image_directory}/{startup.get('images')[33]}")
+    # chess_seer.py stores its camera's homography in the same file
+    calibration = load_calibration(frame_size=image.shape[1::-1])
+    if calibration is None:
+        calibration = calibrate(image)
+    return calibration
+
+def start_resources():
     '''
-    # detect grid pattern
-    ret, corners = cv2.findCirclesGrid(
-        green, 
-        grid_dimension,
-        flags=cv2.CALIB_CB_SYMMETRIC_GRID + cv2.CALIB_CB_CLUSTERING
-    )
-    
-    print(ret, corners)
+    Starts the engine, the image list and the calibration tables in the
+    background, all at once.
     '''
-    gray = cv2.cvtColor(green, cv2.COLOR_BGR2GRAY)
+    startup = Startup()
+    startup.start("engine", open_engine)
+    startup.start("images", lambda: sorted(os.listdir(image_directory)))
+    startup.start("calibration", board_calibration, startup)
+    # Trained by color_lut.py, pieces are classified by HSV rules without it
+    startup.start("color_lut", load_lut)
+    return startup
+
+def close_resources(startup):
+    # Waits for the engine to finish starting so it can be closed
+    try:
+        engine = startup.get("engine")
+    except (OSError, RuntimeError) as error:
+        print(f"Engine unavailable: {error}")
+    else:
+        engine.close()
+        engine.pool.cache.close()
+    startup.shutdown()
+
+def main():
+    startup = start_resources()
+    images = startup.get("images")
+    calibration = startup.get("calibration")
+    if calibration is None:
+        # calibrate() has already reported that the board was not found
+        startup.report()
+        close_resources(startup)
+        return
+    homography, board_size = calibration
+    square = board_size // 8
+    color_lut = startup.get("color_lut")
+    # Every frame is processed in the same preallocated buffers
+    pipeline = FramePipeline(board_size, color_threshold_lower, color_threshold_upper, blur)
+
+    # Keeps the real game state (side to move, castling rights) for the engine
+    tracker = GameTracker()
+    startup.report()
+
+    for move, image in zip(demo_moves + ["Checkmate!"], [images[33]] + images[15:33] + images[:15]):
+        # load the image
+        image = cv2.imread(f"{image_directory}/{image}")
+        # break the loop if no image is found or loaded
+        if image is None:
+            print("Error: Image not found or could not be loaded")
+            break
+
+        # warp to the top-down board, convert it to HSV and mask it
+        # Colored pixels = black, everything else white
+        board, hsv, colors = pipeline.run(image, homography)
+        green = cv2.cvtColor(colors, cv2.COLOR_GRAY2BGR)
+
+        cv2.imshow('Detected Circles', green)
     
-    circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, 20, param1=20, param2=10, minRadius=15, maxRadius=30)
+        # display images
+        # cv2.imshow('image.jpg', image)
+        # cv2.imshow('green.jpg', green)
     
-    #print(circles)
-
-    chess_grid = np.full((8,8), ' ', dtype=str)
+        '''
+        # detect grid pattern
+        ret, corners = cv2.findCirclesGrid(
+            green, 
+            grid_dimension,
+            flags=cv2.CALIB_CB_SYMMETRIC_GRID + cv2.CALIB_CB_CLUSTERING
+        )
+    
+        print(ret, corners)
+        '''
+        if detector_engine == "hough":
+            circles = find_circles(pipeline.blurred, **hough_settings)
+            if color_lut is not None:
+                chess_grid = grid_from_lut(board, circles, color_lut, board_box(board_size), split_rim)
+            else:
+                chess_grid = grid_from_circles(hsv, circles, board_box(board_size), split_rim)
+        else:
+            circles = []
+            chess_grid = detect_board(board, board_box(board_size), detector_engine, hsv=hsv,
+                                      lower=color_threshold_lower, blur=blur, split_rim=split_rim,
+                                      **hough_settings)
     
-    if circles is not None:
-        circles = np.uint16(np.around(circles))
-        circles = sorted(circles[0], key=lambda t: (t[0], t[1]))
+        #print(circles)
+
         for i in circles:
-            piece = get_piece(hsv, i)
-            chess_grid[piece_coordinate(i)] = piece
-            cv2.circle(green, (i[0], i[1]), i[2], (0, 255, 0), 2)
-        for r in rows:
-            cv2.line(green, (80, r), (500, r), (0, 0, 255), 5)
-        for c in cols:
-            cv2.line(green, (c, 0), (c, 400), (0, 0, 255), 5)
-        
+            cv2.circle(green, (int(i[0]), int(i[1])), int(i[2]), (0, 255, 0), 2)
+        for k in range(1, 8):
+            cv2.line(green, (0, k * square), (board_size, k * square), (0, 0, 255), 5)
+            cv2.line(green, (k * square, 0), (k * square, board_size), (0, 0, 255), 5)
+    
         # cv2.imshow('Detected Circles', green)
         # cv2.waitKey(0)
         # cv2.destroyAllWindows()
 
-    print_board(chess_grid)
-    print(f"Engine's move: {move}")
+        detected = tracker.update(chess_grid)
+
+        print_board(chess_grid)
+        print(f"Detected move: {detected}")
+        print(f"Engine's move: {move}")
+        # The engine is used once it is up, frames are not held back for it
+        if detected is not None and startup.ready("engine") and not startup.failed("engine"):
+            engine = startup.get("engine")
+            # Timeouts are OSErrors and engine errors RuntimeErrors; the
+            # demo goes on without the engine's answer
+            try:
+                if tracker.board.turn == robot_color:
+                    print(f"Engine suggests: {engine.answer(tracker.board).move}")
+                else:
+                    # The human thinks while the engine answers their likely moves
+                    engine.speculate(tracker.board)
+            except (OSError, RuntimeError) as error:
+                print(f"Engine failed: {error!r}")
+
+        cv2.namedWindow('Detected Circles:', cv2.WINDOW_NORMAL)
+        cv2.resizeWindow('Detected Circles:', 640, 480)
+        cv2.moveWindow('Detected Circles:', 1000, 1200)
+        cv2.imshow('Detected Circles:', green)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
 
-    cv2.namedWindow('Detected Circles:', cv2.WINDOW_NORMAL)
-    cv2.resizeWindow('Detected Circles:', 640, 480)
-    cv2.moveWindow('Detected Circles:', 1000, 1200)
-    cv2.imshow('Detected Circles:', green)
-    cv2.waitKey(0)
     cv2.destroyAllWindows()
 
-cv2.destroyAllWindows()
+    close_resources(startup)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chess
+import chess.engine
+import chess.pgn
+import chess.polyglot
+
+from engine_pool import EnginePool, default_limit, fake_engine, search_limit, stockfish_path
+
+cache_path = "./move_cache.sqlite"
+# Stored positions at most, the least recently used are dropped beyond it
+max_entries = 100000
+# Stores and use times written to disk together, one commit per batch
+commit_every = 16
+# Search fields that make up the cache key; clock limits depend on the game
+# and are never cached
+limit_fields = ("time", "depth", "nodes", "mate")
+
+def limit_key(limit):
+    '''
+    A chess.engine.Limit as "depth=12,time=0.1" text, or None if it uses
+    clocks and its result cannot be reused.
+    '''
+    if any(getattr(limit, field) is not None for field in ("white_clock", "black_clock", "remaining_moves")):
+        return None
+    return ",".join(f"{field}={getattr(limit, field)}" for field in limit_fields if getattr(limit, field) is not None)
+
+def position_key(board):
+    '''
+    The Polyglot Zobrist hash of a position as a signed 64-bit int, as
+    sqlite stores integers. Side to move, castling and en passant rights are
+    part of the hash; the move counters are not.
+    '''
+    key = chess.polyglot.zobrist_hash(board)
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+class MoveCache:
+    '''
+    Engine results stored on disk by position and search limit, so positions
+    seen before, such as replayed openings and demo games, skip the engine.
+    Lookups refresh an entry's use time and the least recently used entries
+    are dropped once there are more than max_entries. The database is only
+    used from one worker thread, which lookup() and store() hand the work
+    to, so a slow disk never stalls the engine pool's event loop. Use times
+    and new entries are committed in batches.
+
+    Attributes:
+        path;           str;                    sqlite database file
+        max_entries;    int;                    entries kept at most
+        connection;     sqlite3.Connection;     open database
+        count;          int;                    entries in the database
+        used;           dict;                   (key, search) to use times not written yet
+        hits;           int;                    lookups answered since opening
+        misses;         int;                    lookups that found nothing
+    '''
+
+    def __init__(self, path=cache_path, max_entries=max_entries, commit_every=commit_every):
+        self.path = path
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="move-cache")
+        # Opened here, used from the worker thread afterwards
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS moves ("
+            "key INTEGER, search TEXT, move TEXT, cp INTEGER, mate INTEGER, depth INTEGER, used REAL, "
+            "PRIMARY KEY (key, search))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS moves_used ON moves (used)")
+        self.connection.commit()
+        self.count = self.connection.execute("SELECT COUNT(*) FROM moves").fetchone()[0]
+        self.used = {}
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, board, limit):
+        '''
+        The stored chess.engine.PlayResult for a position and limit, None if
+        there is none or its move is not legal here.
+        '''
+        search = limit_key(limit)
+        if search is None:
+            return None
+        key = position_key(board)
+        row = self.connection.execute(
+            "SELECT move, cp, mate, depth FROM moves WHERE key = ? AND search = ?", (key, search)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        move, cp, mate, depth = row
+        move = chess.Move.from_uci(move)
+        if move not in board.legal_moves:
+            self.misses += 1
+            return None
+        self.used[key, search] = time.time()
+        self.hits += 1
+        info = {}
+        if cp is not None or mate is not None:
+            score = chess.engine.Mate(mate) if mate is not None else chess.engine.Cp(cp)
+            info["score"] = chess.engine.PovScore(score, board.turn)
+        if depth is not None:
+            info["depth"] = depth
+        return chess.engine.PlayResult(move, None, info)
+
+    def put(self, board, limit, result):
+        '''
+        Stores an engine result. Results without a move, and limits that use
+        clocks, are not stored.
+        '''
+        search = limit_key(limit)
+        if search is None or result.move is None:
+            return
+        score = result.info.get("score")
+        cp = mate = None
+        if score is not None:
+            cp = score.pov(board.turn).score()
+            mate = score.pov(board.turn).mate()
+        key = position_key(board)
+        row = (result.move.uci(), cp, mate, result.info.get("depth"), time.time())
+        inserted = self.connection.execute(
+            "INSERT OR IGNORE INTO moves VALUES (?, ?, ?, ?, ?, ?, ?)", (key, search, *row)
+        ).rowcount
+        if inserted:
+            self.count += 1
+        else:
+            self.connection.execute(
+                "UPDATE moves SET move = ?, cp = ?, mate = ?, depth = ?, used = ? WHERE key = ? AND search = ?",
+                (*row, key, search),
+            )
+        self.used.pop((key, search), None)
+        self.pending += 1
+        if self.count > self.max_entries:
+            self.trim()
+        if self.pending >= self.commit_every:
+            self.flush()
+
+    def trim(self):
+        # Recent hits must be on disk before the oldest entries are picked
+        self.flush()
+        deleted = self.connection.execute(
+            "DELETE FROM moves WHERE rowid IN (SELECT rowid FROM moves ORDER BY used LIMIT ?)",
+            (self.count - self.max_entries,),
+        ).rowcount
+        self.count -= deleted
+        self.connection.commit()
+
+    def flush(self):
+        '''
+        Writes the pending use times and commits.
+        '''
+        if self.used:
+            self.connection.executemany(
+                "UPDATE moves SET used = ? WHERE key = ? AND search = ?",
+                [(used, key, search) for (key, search), used in self.used.items()],
+            )
+            self.used.clear()
+        self.connection.commit()
+        self.pending = 0
+
+    async def lookup(self, board, limit):
+        '''
+        get() on the worker thread, for the event loop.
+        '''
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.get, board.copy(), limit)
+
+    def store(self, board, limit, result):
+        '''
+        Queues put() on the worker thread and returns at once.
+        '''
+        self.executor.submit(self.put, board.copy(), limit, result)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self.executor.submit(self.flush)
+        self.executor.shutdown(wait=True)
+        self.connection.close()
+
+    def __len__(self):
+        return self.count
+
+def pgn_positions(path):
+    '''
+    Every position of every game in a PGN file in which a move was played,
+    without repeats.
+    '''
+    positions = {}
+    with open(path) as pgn:
+        while (game := chess.pgn.read_game(pgn)) is not None:
+            board = game.board()
+            for move in game.mainline_moves():
+                positions.setdefault(position_key(board), board.copy(stack=False))
+                board.push(move)
+    return list(positions.values())
+
+async def warmup(positions, cache, command, limit, engines):
+    '''
+    Searches the positions that are not cached yet, engines at a time, and
+    stores the results. Returns how many were searched.
+    '''
+    misses = cache.misses
+    async with EnginePool(command, size=engines, limit=limit, cache=cache) as pool:
+        await asyncio.gather(*(pool.play(board) for board in positions))
+    return cache.misses - misses
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-analyze the positions of PGN games into the move cache")
+    parser.add_argument("pgns", nargs="*", help="PGN files to warm the cache with")
+    parser.add_argument("--cache", default=cache_path)
+    parser.add_argument("--engine", default=stockfish_path, help="UCI engine, the fake engine if it does not exist")
+    parser.add_argument("--engines", type=int, default=2, help="engine processes in the pool")
+    parser.add_argument("--time", type=float, help="seconds per position")
+    parser.add_argument("--depth", type=int, help="search depth per position")
+    args = parser.parse_args()
+
+    cache = MoveCache(args.cache)
+    limit = search_limit(time=args.time, depth=args.depth) or default_limit
+    command = args.engine
+    if not os.path.exists(command):
+        print(f"Warning: {command} not found, using the fake engine", file=sys.stderr)
+        command = fake_engine
+    for path in args.pgns:
+        positions = pgn_positions(path)
+        start = time.perf_counter()
+        searched = asyncio.run(warmup(positions, cache, command, limit, args.engines))
+        print(f"{path}: {len(positions)} positions, {searched} searched in {time.perf_counter() - start:.1f} s")
+    # Waits for the queued stores
+    cache.close()
+    print(f"{args.cache}: {len(cache)} positions cached")
@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+
+blue = (82, 113, 255)
+green = (0, 191, 99)
+red = (255, 49, 49)
+pink = (255, 102, 196)
+orange = (255, 145, 77)
+yellow = (255, 222, 89)
+
+# OpenCV stores hue as 0-179, so distances wrap around at 180
+hue_range = 180
+
+def get_hue(rgb_color):
+    rgb_array = np.uint8([[list(rgb_color)]])
+    hsv_array = cv2.cvtColor(rgb_array, cv2.COLOR_RGB2HSV)
+    hsv_color = tuple(hsv_array[0][0])
+    return hsv_color[0]
+
+hues = (
+    (get_hue(blue), 'p'),
+    (get_hue(green), 'b'),
+    (get_hue(red), 'k'),
+    (get_hue(pink), 'n'),
+    (get_hue(orange), 'q'),
+    (get_hue(yellow), 'r')
+)
+
+piece_hues = np.array([hue for hue, _ in hues], dtype=np.int16)
+piece_types = np.array([piece_type for _, piece_type in hues])
+
+def uv_hue(u, v):
+    '''
+    Angle of the chroma vector of YUV pixels, on the same 0-179 scale as
+    OpenCV hue so the same distance and classification code applies.
+    '''
+    u = np.asarray(u, dtype=np.float32) - 128
+    v = np.asarray(v, dtype=np.float32) - 128
+    return (np.degrees(np.arctan2(v, u)) % 360 / 2).astype(np.int16) % hue_range
+
+def get_uv_hue(rgb_color):
+    yuv_color = cv2.cvtColor(np.uint8([[list(rgb_color)]]), cv2.COLOR_RGB2YUV)[0][0]
+    return uv_hue(yuv_color[1], yuv_color[2])
+
+piece_uv_hues = np.array([get_uv_hue(color) for color in (blue, green, red, pink, orange, yellow)], dtype=np.int16)
+
+def hue_distance(a, b):
+    '''
+    Circular distance between OpenCV hues, broadcast over both arguments.
+    '''
+    dist = np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16))
+    return np.minimum(dist, hue_range - dist)
+
+def classify_hues(rim_hue, center_val, reference=piece_hues):
+    '''
+    Maps arrays of rim hues and center values to piece letters.
+    '''
+    dist = hue_distance(np.asarray(rim_hue)[:, None], reference[None, :])
+    types = piece_types[np.argmin(dist, axis=1)]
+    return np.where(np.asarray(center_val) > 128, np.char.upper(types), types)
+
+def rim_samples(shape, circles, split_rim=False):
+    '''
+    Pixel coordinates to sample for every circle: (rows, cols) of three rim
+    candidates per circle and (y, x) of the centers.
+    '''
+    height, width = shape[:2]
+    x = np.clip(circles[:, 0], 0, width - 1)
+    y = np.clip(circles[:, 1], 0, height - 1)
+    r = circles[:, 2]
+    rim_y = y + r - 2
+    if split_rim:
+        rim_y = np.where(y < height // 2, rim_y, y - r + 2)
+    sample_x = np.clip(np.stack([x, x - r + 2, x + r - 2], axis=1), 0, width - 1)
+    sample_y = np.clip(np.stack([rim_y, y, y], axis=1), 0, height - 1)
+    return (sample_y, sample_x), (y, x)
+
+def classify_pieces(image, circles, split_rim=False):
+    '''
+    Classifies every detected circle at once.
+
+    image is the HSV frame and circles the (x, y, r) rows returned by
+    HoughCircles. The rim is sampled just inside the bottom, left and right
+    edges of each circle and the most saturated sample is kept, so a circle
+    that is slightly off center still lands one sample on the ring. With
+    split_rim the circles in the lower half of the frame are sampled at
+    their top edge instead of the bottom, which keeps the sample on the ring
+    when the camera looks at the board at an angle. Returns one piece letter
+    per circle, upper case for white pieces.
+    '''
+    circles = np.asarray(circles).reshape(-1, 3).astype(np.intp)
+    if not len(circles):
+        return np.empty(0, dtype=str)
+    rim, center = rim_samples(image.shape, circles, split_rim)
+    samples = image[rim]
+    strength = samples[..., 1].astype(np.uint16) * samples[..., 2]
+    best = np.argmax(strength, axis=1)
+    rim_hue = samples[np.arange(len(circles)), best, 0]
+    return classify_hues(rim_hue, image[center][:, 2])
+
+def classify_pieces_yuv(luma, u, v, circles, split_rim=False):
+    '''
+    classify_pieces for separate Y, U and V planes of the same size. The rim
+    sample with the strongest chroma is kept and its chroma angle compared
+    against the piece colors; the center luma decides white or black.
+    '''
+    circles = np.asarray(circles).reshape(-1, 3).astype(np.intp)
+    if not len(circles):
+        return np.empty(0, dtype=str)
+    rim, center = rim_samples(luma.shape, circles, split_rim)
+    rim_u = u[rim].astype(np.int16) - 128
+    rim_v = v[rim].astype(np.int16) - 128
+    best = np.argmax(np.abs(rim_u) + np.abs(rim_v), axis=1)
+    pick = np.arange(len(circles)), best
+    rim_hue = uv_hue(rim_u[pick] + 128, rim_v[pick] + 128)
+    return classify_hues(rim_hue, luma[center], piece_uv_hues)
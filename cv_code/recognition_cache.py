@@ -0,0 +1,81 @@
+from collections import OrderedDict
+
+import cv2
+
+# Boards remembered before the least recently seen one is evicted
+cache_size = 16
+# Side of the board thumbnail boards are compared by, 4 px per square
+fingerprint_size = 32
+# Largest per pixel difference between thumbnails that still counts as the same board
+cache_tolerance = 12
+
+def board_fingerprint(board, size=fingerprint_size):
+    '''
+    Perceptual fingerprint of a rectified board (BGR or a single plane):
+    the board area-averaged down to size x size, which smooths sensor noise
+    but still changes by tens of levels where a piece appears or leaves.
+    '''
+    return cv2.resize(board, (size, size), interpolation=cv2.INTER_AREA)
+
+class RecognitionCache:
+    '''
+    LRU cache of recognition results keyed by board fingerprints. While
+    nobody touches the board consecutive frames match a stored fingerprint
+    and the previous result is reused without running detection.
+
+    Attributes:
+        maxsize;    int;            fingerprints kept
+        tolerance;  int;            largest pixel difference of a hit
+        entries;    OrderedDict;    fingerprint bytes to (fingerprint, result), oldest first
+        hits;       int;            lookups answered from the cache
+        misses;     int;            lookups that needed a recognition
+    '''
+
+    def __init__(self, maxsize=cache_size, tolerance=cache_tolerance, size=fingerprint_size):
+        self.maxsize = maxsize
+        self.tolerance = tolerance
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, board):
+        return board_fingerprint(board, self.size)
+
+    def find(self, fingerprint):
+        key = fingerprint.tobytes()
+        if key in self.entries:
+            return key
+        # The board usually matches what was seen last, so search newest first
+        for key, (stored, _) in reversed(self.entries.items()):
+            if stored.shape == fingerprint.shape and cv2.norm(stored, fingerprint, cv2.NORM_INF) <= self.tolerance:
+                return key
+        return None
+
+    def get(self, fingerprint):
+        '''
+        Returns the result stored for a matching fingerprint, or None.
+        '''
+        key = self.find(fingerprint)
+        if key is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][1]
+
+    def put(self, fingerprint, result):
+        self.entries[fingerprint.tobytes()] = (fingerprint.copy(), result)
+        self.entries.move_to_end(fingerprint.tobytes())
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,76 @@
+import argparse
+import sys
+import time
+
+import chess
+
+# A stand-in UCI engine for trying the engine pool without Stockfish. It
+# plays the legal moves in sorted UCI order, best first, and can be told to
+# think slowly, crash or hang.
+
+parser = argparse.ArgumentParser(description="Minimal UCI engine for testing")
+parser.add_argument("--delay", type=float, default=0.0, help="seconds to think per search, capped by movetime")
+parser.add_argument("--crash-after", type=int, default=0, help="exit during this many'th search")
+parser.add_argument("--hang-after", type=int, default=0, help="stop answering after this many searches")
+args = parser.parse_args()
+
+board = chess.Board()
+multipv = 1
+searches = 0
+
+def reply(line):
+	sys.stdout.write(line + "\n")
+	sys.stdout.flush()
+
+def set_position(words):
+	global board
+	if words[1] == "startpos":
+		board = chess.Board()
+		rest = words[2:]
+	else:
+		end = words.index("moves") if "moves" in words else len(words)
+		board = chess.Board(" ".join(words[2:end]))
+		rest = words[end:]
+	for move in rest[1:]:
+		board.push_uci(move)
+
+def search(words):
+	global searches
+	searches += 1
+	if args.crash_after and searches >= args.crash_after:
+		sys.exit(1)
+	delay = args.delay
+	if "movetime" in words:
+		delay = min(delay, int(words[words.index("movetime") + 1]) / 1000)
+	time.sleep(delay)
+	moves = sorted(move.uci() for move in board.legal_moves)
+	if not moves:
+		reply("info depth 0 score cp 0")
+		reply("bestmove (none)")
+		return
+	for rank, move in enumerate(moves[:multipv], 1):
+		reply(f"info depth 1 seldepth 1 multipv {rank} score cp {-10 * rank} nodes {len(moves)} pv {move}")
+	reply(f"bestmove {moves[0]}")
+
+for line in sys.stdin:
+	words = line.split()
+	if not words:
+		continue
+	if args.hang_after and searches >= args.hang_after:
+		continue
+	if words[0] == "uci":
+		reply("id name FakeUCI")
+		reply("id author Amy-the-Arm")
+		reply("option name MultiPV type spin default 1 min 1 max 500")
+		reply("option name Hash type spin default 16 min 1 max 1024")
+		reply("uciok")
+	elif words[0] == "isready":
+		reply("readyok")
+	elif words[0] == "setoption" and words[2].lower() == "multipv":
+		multipv = int(words[-1])
+	elif words[0] == "position":
+		set_position(words)
+	elif words[0] == "go":
+		search(words)
+	elif words[0] == "quit":
+		break
@@ -1,24 +1,29 @@
+import asyncio
+import os
+import sys
+
 import chess
-import chess.engine
-import time
 
-stockfish_path = "../venv/Stockfish/src/stockfish"
-engine = chess.engine.SimpleEngine.popen_uci(stockfish_path)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from engine_pool import EnginePool
 
-board = chess.Board()
-board.set_fen("8/8/8/8/8/3k4/8/3K4 w - - 0 1")
+stockfish_path = "../venv/Stockfish/src/stockfish"
 
-print(board)
-print()
+async def play_out(pool, fen):
+	board = chess.Board(fen)
+	while not board.is_game_over():
+		board.push(await pool.best_move(board, time=0.1))
+	return board
 
-while not board.is_game_over():
-	result = engine.play(board, chess.engine.Limit(time=0.1))
-	board.push(result.move)
-	#result = engine.play(board, chess.engine.Limit(time=0.1))
-	#board.push(result.move)
-	#time.sleep(0.5)
-	print("\033c")
-	print(board)
-print(board.result())
+async def main(command):
+	# Both endgames are played at the same time, one engine process each
+	fens = ["8/8/8/8/8/3k4/8/3K4 w - - 0 1", "8/8/8/8/8/3k4/8/R2K4 w - - 0 1"]
+	async with EnginePool(command, size=len(fens)) as pool:
+		boards = await asyncio.gather(*(play_out(pool, fen) for fen in fens))
+	for board in boards:
+		print(board)
+		print(board.result())
+		print()
 
-engine.quit()
+command = stockfish_path if os.path.exists(stockfish_path) else [sys.executable, os.path.join(os.path.dirname(__file__), "fake_uci.py")]
+asyncio.run(main(command))
@@ -0,0 +1,68 @@
+import os
+import re
+import sys
+
+import chess
+
+from batch_recognize import list_images
+from game_tracker import board_grid
+
+# moveNN_S_SAN.png, S is 0 for White's move and 1 for Black's. One file
+# has a dash instead of the first underscore, so accept both.
+move_name = re.compile(r"move(\d+)[_-]([01])_(.+)\.\w+$")
+start_name = "start_position"
+
+def parse_move_name(filename):
+    '''
+    Returns (move number, side, SAN) for a move image name, or None if the
+    name does not follow the pattern. Castling is spelled OO/OOO in file
+    names since dashes are already taken.
+    '''
+    found = move_name.match(os.path.basename(filename))
+    if found is None:
+        return None
+    number, side, san = found.groups()
+    san = re.sub(r"^O(O+)", lambda castle: "O" + "-O" * len(castle.group(1)), san)
+    return int(number), int(side), san
+
+def labeled_sequence(directory):
+    '''
+    Replays the game encoded in a directory's file names and returns
+    (path, chess.Board) pairs in game order, starting with the start
+    position. A gap in the move numbers ends the sequence, since the
+    positions after a missing move are unknown. Raises ValueError if a move
+    does not fit the game so far.
+    '''
+    start = None
+    moves = []
+    for path in list_images(directory):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name == start_name:
+            start = path
+            continue
+        parsed = parse_move_name(path)
+        if parsed is not None:
+            moves.append((parsed, path))
+    if start is None:
+        raise ValueError(f"No {start_name} image in {directory}")
+
+    board = chess.Board()
+    sequence = [(start, board.copy())]
+    for (number, side, san), path in sorted(moves):
+        if 2 * (number - 1) + side != board.ply():
+            print(f"Warning: move before {os.path.basename(path)} is missing in {directory}, "
+                  f"labeling stops there", file=sys.stderr)
+            break
+        try:
+            board.push_san(san)
+        except ValueError as error:
+            raise ValueError(f"{os.path.basename(path)} does not fit the game: {error}") from error
+        sequence.append((path, board.copy()))
+    return sequence
+
+def labeled_grids(directory):
+    '''
+    (path, chess_grid) pairs of the true positions, for comparing against
+    recognized grids.
+    '''
+    return [(path, board_grid(board)) for path, board in labeled_sequence(directory)]
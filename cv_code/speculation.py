@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import chess
+import chess.engine
+
+from autotune import default_sets
+from engine_pool import EnginePool, default_limit, fake_engine, stockfish_path
+from sequence_labels import labeled_sequence
+
+# Likely human replies whose answers are computed ahead
+speculation_width = 4
+# Multi-PV search that ranks the human's replies, kept short so the answers
+# start early
+ranking_limit = chess.engine.Limit(time=0.05)
+# Answers kept at most, the least likely are dropped first
+max_answers = 8
+
+class Speculator:
+    '''
+    Uses the engine while the human is thinking. For the position the human
+    has to move in, a short multi-PV search ranks their likely replies and
+    the engine's answer to each is searched in the background. When the
+    human's actual move arrives, a predicted move is answered from those
+    searches, which are finished or at least well under way. Any other
+    move, or a position that does not follow from the speculated one,
+    discards the speculation.
+
+    Attributes:
+        pool;       EnginePool;     engines the speculative and regular searches share
+        width;      int;            replies answered ahead per position
+        limit;      chess.engine.Limit; search limit of the engine's answers
+        position;   chess.Board;    position being speculated on, None if none
+        answers;    OrderedDict;    human reply to the asyncio.Task of the engine's PlayResult, most likely first
+        hits;       int;            human moves answered from speculation
+        misses;     int;            human moves that needed a new search
+    '''
+
+    def __init__(self, pool, width=speculation_width, limit=None, ranking_limit=ranking_limit,
+                 max_answers=max_answers):
+        self.pool = pool
+        self.width = width
+        self.limit = limit or pool.limit
+        self.ranking_limit = ranking_limit
+        self.max_answers = max_answers
+        self.position = None
+        self.ranking = None
+        self.answers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def likely_replies(self, board):
+        infos = await self.pool.analyse(board, self.ranking_limit, multipv=self.width)
+        return [info["pv"][0] for info in infos if info.get("pv")]
+
+    async def precompute(self, board):
+        for reply in await self.likely_replies(board):
+            if len(self.answers) >= self.max_answers:
+                break
+            after = board.copy()
+            after.push(reply)
+            self.answers[reply] = asyncio.create_task(self.pool.play(after, self.limit))
+
+    def speculate(self, board):
+        '''
+        Starts answering the likely replies in the position the human has to
+        move in, replacing any earlier speculation. Returns at once; must be
+        called on the pool's event loop.
+        '''
+        self.discard()
+        if board.is_game_over():
+            return
+        self.position = board.copy()
+        self.ranking = asyncio.create_task(self.precompute(self.position))
+
+    def discard(self):
+        if self.ranking is not None:
+            self.ranking.cancel()
+        for task in self.answers.values():
+            task.cancel()
+        self.position = None
+        self.ranking = None
+        self.answers.clear()
+
+    def human_move(self, board):
+        '''
+        The move that leads from the speculated position to board, None if
+        board does not follow from it by one move.
+        '''
+        if self.position is None or not board.move_stack:
+            return None
+        before = board.copy()
+        move = before.pop()
+        if before.fen() != self.position.fen():
+            return None
+        return move
+
+    async def answer(self, board):
+        '''
+        The engine's chess.engine.PlayResult for the position after the
+        human's move, from the speculative search when the move was one of
+        the predicted replies.
+        '''
+        task = self.answers.pop(self.human_move(board), None)
+        self.discard()
+        if task is not None and not task.cancelled():
+            try:
+                result = await task
+            except (asyncio.TimeoutError, chess.engine.EngineError):
+                pass
+            else:
+                self.hits += 1
+                return result
+        self.misses += 1
+        return await self.pool.play(board, self.limit)
+
+    async def best_move(self, board):
+        return (await self.answer(board)).move
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+async def replay(directory, pool, speculator, think):
+    '''
+    Plays back a labeled game with the human as White. Speculation runs for
+    think seconds of each White turn, then the time until the engine's
+    answer to White's recorded move is measured. Black's recorded moves are
+    played regardless of the engine's answers.
+    '''
+    waits = []
+    boards = [board for _, board in labeled_sequence(directory)]
+    for before, after in zip(boards, boards[1:]):
+        if before.turn != chess.WHITE:
+            continue
+        speculator.speculate(before)
+        await asyncio.sleep(think)
+        start = time.perf_counter()
+        await speculator.answer(after)
+        waits.append((time.perf_counter() - start) * 1000)
+    return waits
+
+async def main(args):
+    command = args.engine if os.path.exists(args.engine) else fake_engine
+    limit = chess.engine.Limit(time=args.time)
+    async with EnginePool(command, size=args.engines, limit=limit) as pool:
+        speculator = Speculator(pool, args.width)
+        for directory in args.directories:
+            waits = await replay(directory, pool, speculator, args.think)
+            if waits:
+                waits.sort()
+                print(f"{os.path.basename(os.path.normpath(directory))}: {len(waits)} human moves, "
+                      f"median wait {waits[len(waits) // 2]:.1f} ms, max {waits[-1]:.1f} ms")
+        print(f"{speculator.hits} answered from speculation, {speculator.misses} searched, "
+              f"hit rate {speculator.hit_rate():.0%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay labeled games and time the engine's answers with speculation")
+    parser.add_argument("directories", nargs="*", default=default_sets)
+    parser.add_argument("--engine", default=stockfish_path, help="UCI engine, the fake engine if it does not exist")
+    parser.add_argument("--engines", type=int, default=2, help="engine processes in the pool")
+    parser.add_argument("--width", type=int, default=speculation_width, help="replies answered ahead")
+    parser.add_argument("--time", type=float, default=default_limit.time, help="seconds per answer")
+    parser.add_argument("--think", type=float, default=0.5, help="seconds the human thinks")
+    args = parser.parse_args()
+    if not os.path.exists(args.engine):
+        print(f"Warning: {args.engine} not found, using the fake engine", file=sys.stderr)
+    asyncio.run(main(args))
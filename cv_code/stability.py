@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+# Frames the scene has to stay still before a recognition is triggered
+stable_frames = 5
+# Mean absolute luma difference between frames that counts as motion
+motion_threshold = 2.0
+# Size of the luma thumbnail the frames are compared at
+thumbnail_size = (80, 60)
+
+class StabilityGate:
+    '''
+    Cheap motion detector that holds recognition while a hand or the arm is
+    over the board. Frames are shrunk to a small luma thumbnail and
+    differenced against the previous one; once the scene has been still for
+    a number of frames the gate opens exactly once, and it re-arms only after
+    motion is seen again.
+
+    Attributes:
+        frames;     int;    still frames needed before triggering
+        threshold;  float;  mean absolute difference that counts as motion
+        yuv;        bool;   frames are YUV420 buffers, use their Y plane
+        motion;     float;  difference measured on the last frame
+    '''
+
+    def __init__(self, frames=stable_frames, threshold=motion_threshold,
+                 size=thumbnail_size, yuv=False):
+        self.frames = frames
+        self.threshold = threshold
+        self.size = size
+        self.yuv = yuv
+        self.thumbnail = np.empty(size[::-1], dtype=np.uint8)
+        self.previous = np.empty(size[::-1], dtype=np.uint8)
+        self.difference = np.empty(size[::-1], dtype=np.uint8)
+        self.started = False
+        self.still = 0
+        self.fired = False
+        self.motion = 0.0
+
+    def shrink(self, image):
+        if self.yuv:
+            image = image[:image.shape[0] * 2 // 3]
+        if image.ndim == 2:
+            return cv2.resize(image, self.size, dst=self.thumbnail, interpolation=cv2.INTER_AREA)
+        small = cv2.resize(image, self.size, interpolation=cv2.INTER_AREA)
+        code = cv2.COLOR_BGRA2GRAY if small.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        return cv2.cvtColor(small, code, dst=self.thumbnail)
+
+    def update(self, image):
+        '''
+        Feeds one frame. Returns True on the frame that should be recognized.
+        '''
+        self.shrink(image)
+        if not self.started:
+            self.started = True
+            self.thumbnail, self.previous = self.previous, self.thumbnail
+            return False
+        cv2.absdiff(self.thumbnail, self.previous, dst=self.difference)
+        self.motion = cv2.mean(self.difference)[0]
+        self.thumbnail, self.previous = self.previous, self.thumbnail
+        if self.motion > self.threshold:
+            self.still = 0
+            self.fired = False
+            return False
+        self.still += 1
+        if self.still >= self.frames and not self.fired:
+            self.fired = True
+            return True
+        return False
@@ -0,0 +1,62 @@
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class Startup:
+    '''
+    Starts slow resources (the engine process, the camera, calibration
+    tables) concurrently on background threads, so a restart only waits for
+    the slowest one and only when it is first used. Records how long each
+    took to become ready.
+
+    Attributes:
+        futures;    dict;   resource name to its concurrent.futures.Future
+        seconds;    dict;   resource name to seconds from start until it was ready
+        started;    float;  time.monotonic() when startup began
+    '''
+
+    def __init__(self, workers=4):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="startup")
+        self.futures = {}
+        self.seconds = {}
+        self.started = time.monotonic()
+
+    def start(self, name, factory, *args, **kwargs):
+        '''
+        Begins creating a resource in the background and returns at once.
+        '''
+        def create():
+            try:
+                return factory(*args, **kwargs)
+            finally:
+                self.seconds[name] = time.monotonic() - self.started
+        self.futures[name] = self.executor.submit(create)
+        return self
+
+    def get(self, name, timeout=None):
+        '''
+        Waits for a resource and returns it, raising whatever creating it
+        raised.
+        '''
+        return self.futures[name].result(timeout)
+
+    def ready(self, name):
+        return self.futures[name].done()
+
+    def failed(self, name):
+        future = self.futures[name]
+        return future.done() and future.exception() is not None
+
+    def report(self, file=sys.stderr):
+        print(f"Startup after {time.monotonic() - self.started:.3f} s:", file=file)
+        for name, future in self.futures.items():
+            if not future.done():
+                state = "starting"
+            elif future.exception() is not None:
+                state = f"failed after {self.seconds[name]:.3f} s ({future.exception()})"
+            else:
+                state = f"ready after {self.seconds[name]:.3f} s"
+            print(f"  {name:<12}{state}", file=file)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)